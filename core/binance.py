@@ -1,7 +1,9 @@
 """binance.py — Tất cả Binance API calls, dùng chung cho Dashboard & Scanner"""
+import re as _re
 import time as _time
 import threading as _threading
 import requests
+from requests.adapters import HTTPAdapter
 import pandas as pd
 
 FUTURES_BASE = "https://fapi.binance.com"
@@ -33,6 +35,9 @@ def _trip_ban(resp):
     dur = ra if ra > 0 else (300 if resp.status_code == 418 else 10)
     with _ban_lock:
         _banned_until = max(_banned_until, _time.time() + dur)
+    # Mọi 418/429 đều đi qua đây → trừ token bucket của scanner tại chỗ, engine có nuốt
+    # exception thì scan vẫn chậm lại (thay vì sleep cứng từng worker)
+    scan_rate_limiter.penalize(_PENALTY_BAN)
     print(f"[BINANCE {resp.status_code}] rate-limited — backoff {dur}s")
 
 
@@ -41,6 +46,12 @@ def _trip_ban(resp):
 # Binance thấy burst → ban. Guard backoff chỉ chặn SAU khi đã ăn 418.
 # Throttle này serialize MỌI call Binance, cách nhau tối thiểu _MIN_GAP giây
 # → tối đa ~1/_MIN_GAP call/giây toàn cục, không bao giờ burst được nữa.
+# ── HTTP session dùng chung (keep-alive) ─────────────────────────────────
+# Giữ connection TLS tới fapi.binance.com giữa các call thay vì handshake lại mỗi
+# lần. KHÔNG bật max_retries: retry tự động khi 418/429 sẽ đào sâu ban.
+session = requests.Session()
+session.mount("https://", HTTPAdapter(pool_connections=16, pool_maxsize=32))
+
 _gap_lock = _threading.Lock()
 _last_call = 0.0
 _MIN_GAP = 0.15   # 150ms giữa 2 call = ~6.6 call/s = ~400/phút (ngưỡng Binance 2400/phút)
@@ -58,15 +69,87 @@ def _throttle():
     return None
 
 
+class TokenBucket:
+    """Token-bucket theo weight Binance: nạp `rate` token/giây, tối đa `burst`.
+    Còn headroom → acquire() trả ngay (không ngủ vô ích); cạn → chờ đúng phần thiếu."""
+
+    def __init__(self, rate: float, burst: float):
+        self.rate   = float(rate)
+        self.burst  = float(burst)
+        self.tokens = float(burst)
+        self._ts    = _time.monotonic()
+        self._lock  = _threading.Lock()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.burst, self.tokens + (now - self._ts) * self.rate)
+        self._ts = now
+
+    def acquire(self, n: float = 1):
+        """Lấy n token, block tới khi đủ. n > burst bị kẹp về burst (tránh chờ vô hạn)."""
+        n = min(float(n), self.burst)
+        while True:
+            with self._lock:
+                self._refill(_time.monotonic())
+                if self.tokens >= n:
+                    self.tokens -= n
+                    return
+                wait = (n - self.tokens) / self.rate
+            _time.sleep(wait)
+
+    def penalize(self, n: float):
+        """Trừ thêm n token (có thể âm) — dùng khi ăn 429 thay cho sleep cứng."""
+        with self._lock:
+            self._refill(_time.monotonic())
+            self.tokens -= n
+
+
+# Budget weight cho full-market scan: Binance Futures cho 2400 weight/phút/IP,
+# scanner chỉ lấy một nửa (1200/phút) để chừa phần cho dashboard/positions.
+scan_rate_limiter = TokenBucket(rate=1200 / 60, burst=60)
+# Token trừ thêm mỗi lần ăn 418/429 (_trip_ban) → mọi worker scan cùng chậm lại
+_PENALTY_BAN = 40
+
+
+# ── TTL cache klines ─────────────────────────────────────────────────────
+# Nến D1/H4 gần như không đổi trong vài phút → scan/refresh liên tiếp dùng lại, không
+# gọi Binance lần nữa. TTL theo khung (nến đang chạy được phép trễ tối đa TTL); khung
+# ngắn hơn 1h (scalp M15/M5…) không cache. Trả bản copy — prepare() gắn cột vào df.
+KLINES_CACHE_TTL = {"1w": 3600, "1d": 3600, "4h": 900, "1h": 60}
+_KLINES_CACHE_MAX = 2000
+_klines_cache = {}   # (symbol, interval, limit, force_futures) -> (ts, df)
+_klines_cache_lock = _threading.Lock()
+
 def fetch_klines(symbol: str, interval: str, limit: int = 300,
                  force_futures: bool = False) -> pd.DataFrame:
+    ttl = KLINES_CACHE_TTL.get(interval)
+    if not ttl:
+        return _fetch_klines_uncached(symbol, interval, limit, force_futures)
+    key = (symbol, interval, limit, bool(force_futures))
+    now = _time.time()
+    hit = _klines_cache.get(key)
+    if hit is not None and now - hit[0] < ttl:
+        return hit[1].copy()
+    df = _fetch_klines_uncached(symbol, interval, limit, force_futures)
+    with _klines_cache_lock:
+        if len(_klines_cache) >= _KLINES_CACHE_MAX:   # dọn entry hết hạn; vẫn đầy → xoá hết
+            for k in [k for k, (ts, _) in _klines_cache.items()
+                      if now - ts >= KLINES_CACHE_TTL[k[1]]]:
+                del _klines_cache[k]
+            if len(_klines_cache) >= _KLINES_CACHE_MAX:
+                _klines_cache.clear()
+        _klines_cache[key] = (now, df)
+    return df.copy()
+
+
+def _fetch_klines_uncached(symbol: str, interval: str, limit: int = 300,
+                           force_futures: bool = False) -> pd.DataFrame:
     _t = _time
     if _rate_limited():
         raise RuntimeError("Binance rate-limited (đang backoff) — bỏ qua call")
     url = FUTURES_BASE + "/fapi/v1/klines"
     params = {"symbol": symbol, "interval": interval, "limit": limit}
     for attempt in range(3):
-        r = _throttle() or requests.get(url, params=params, timeout=10)
+        r = _throttle() or session.get(url, params=params, timeout=10)
         if r.status_code in (418, 429):
             _trip_ban(r)
             r.raise_for_status()   # fail fast — KHÔNG retry để tránh đào sâu ban
@@ -92,7 +175,7 @@ def fetch_volume_24h(symbol: str) -> float:
     if _rate_limited():
         return 0.0
     try:
-        r = _throttle() or requests.get(FUTURES_BASE + "/fapi/v1/ticker/24hr",
+        r = _throttle() or session.get(FUTURES_BASE + "/fapi/v1/ticker/24hr",
                          params={"symbol": symbol}, timeout=5)
         if r.status_code in (418, 429):
             _trip_ban(r); return 0.0
@@ -101,40 +184,53 @@ def fetch_volume_24h(symbol: str) -> float:
     except Exception:
         return 0.0
 
-def fetch_all_futures_tickers(min_volume_usd: float = 10_000_000) -> list:
-    """Lấy toàn bộ USDT perpetual futures có volume > threshold, đã lọc coin rác."""
-    import re
-
-    # ── Blacklist patterns ──────────────────────────────────────────────
-    # Leverage tokens: BTCUP, ETHDOWN, BNBBULL, BTC2L, ETH3S...
-    LEVERAGE_PAT = re.compile(r'(UP|DOWN|BULL|BEAR|[2-9]L|[2-9]S|HEDGE|HALF)USDT$')
-    # Stablecoins & wrapped USD
-    STABLE_PAT   = re.compile(r'^(USDC|BUSD|TUSD|FDUSD|USDP|DAI|FRAX|LUSD|SUSD|USDD|USTC|GUSD)')
-    # Blacklist cứng
-    BLACKLIST = {"LUNA2USDT", "LUNCUSDT", "LUNAUSDT", "USDTUSDT", "BCCUSDT"}
-    # Giá tối thiểu — coin dưới $0.000001 thường là dead meme
-    MIN_PRICE = 0.000001
-    # ───────────────────────────────────────────────────────────────────
+TICKERS_CACHE_TTL = 60   # giây — 2 lần scan sát nhau dùng chung 1 lần tải /ticker/24hr
+_tickers_cache = (0.0, None)   # (ts, raw list) — gán nguyên tử
 
+def _fetch_tickers_raw() -> list:
+    global _tickers_cache
+    ts, data = _tickers_cache
+    if data is not None and _time.time() - ts < TICKERS_CACHE_TTL:
+        return data
     if _rate_limited():
         raise RuntimeError("Binance rate-limited (đang backoff)")
-    r = _throttle() or requests.get(FUTURES_BASE + "/fapi/v1/ticker/24hr", timeout=15)
+    r = _throttle() or session.get(FUTURES_BASE + "/fapi/v1/ticker/24hr", timeout=15)
     if r.status_code in (418, 429):
         _trip_ban(r)
     r.raise_for_status()
-    out = []
-    for t in r.json():
-        sym = t.get("symbol", "")
-        if not sym.endswith("USDT"):        continue
-        if sym in BLACKLIST:               continue
-        if LEVERAGE_PAT.search(sym):       continue
-        if STABLE_PAT.match(sym):          continue
+    data = r.json()
+    _tickers_cache = (_time.time(), data)
+    return data
+
+
+# ── Lọc coin rác cho fetch_all_futures_tickers (compile 1 lần lúc import) ──
+# Leverage tokens: BTCUP, ETHDOWN, BNBBULL, BTC2L, ETH3S...
+_LEVERAGE_PAT = _re.compile(r'(UP|DOWN|BULL|BEAR|[2-9]L|[2-9]S|HEDGE|HALF)USDT$')
+# Stablecoins & wrapped USD
+_STABLE_PAT   = _re.compile(r'^(USDC|BUSD|TUSD|FDUSD|USDP|DAI|FRAX|LUSD|SUSD|USDD|USTC|GUSD)')
+# Blacklist cứng
+_TICKER_BLACKLIST = frozenset({"LUNA2USDT", "LUNCUSDT", "LUNAUSDT", "USDTUSDT", "BCCUSDT"})
+# Giá tối thiểu — coin dưới $0.000001 thường là dead meme
+_MIN_TICKER_PRICE = 0.000001
 
-        vol   = float(t.get("quoteVolume", 0))
+
+def fetch_all_futures_tickers(min_volume_usd: float = 10_000_000) -> list:
+    """Lấy toàn bộ USDT perpetual futures có volume > threshold, đã lọc coin rác.
+    Raw ticker cache TICKERS_CACHE_TTL; list kết quả luôn dựng mới (caller sửa thoải mái)."""
+    out = []
+    for t in _fetch_tickers_raw():
+        # Volume trước: đa số ~600 pair rớt ở đây → không tốn 2 lần regex cho chúng
+        vol = float(t.get("quoteVolume", 0))
         if vol < min_volume_usd:           continue
 
+        sym = t.get("symbol", "")
+        if not sym.endswith("USDT"):       continue
+        if sym in _TICKER_BLACKLIST:       continue
+        if _LEVERAGE_PAT.search(sym):      continue
+        if _STABLE_PAT.match(sym):         continue
+
         price = float(t.get("lastPrice", 0))
-        if price < MIN_PRICE:              continue
+        if price < _MIN_TICKER_PRICE:      continue
 
         out.append({
             "symbol":           sym,
@@ -143,14 +239,19 @@ def fetch_all_futures_tickers(min_volume_usd: float = 10_000_000) -> list:
             "last_price":       price,
             "is_futures":       True,
         })
-    return sorted(out, key=lambda x: x["volume_24h"], reverse=True)
+    out.sort(key=lambda x: x["volume_24h"], reverse=True)
+    return out
 
 
-def fetch_funding_rate(symbol: str):
+def fetch_funding_rate(symbol: str, funding_map: dict = None):
+    """Funding % của 1 symbol. funding_map (từ fetch_all_funding_rates, scanner gom 1 lần
+    mỗi lượt) có symbol → trả luôn, không gọi API."""
+    if funding_map and symbol in funding_map:
+        return funding_map[symbol]
     if _rate_limited():
         return None
     try:
-        r = _throttle() or requests.get(FUTURES_BASE + "/fapi/v1/premiumIndex",
+        r = _throttle() or session.get(FUTURES_BASE + "/fapi/v1/premiumIndex",
                          params={"symbol": symbol}, timeout=5)
         if r.status_code in (418, 429):
             _trip_ban(r); return None
@@ -168,7 +269,7 @@ def fetch_all_funding_rates() -> dict:
     if _rate_limited():
         return {}
     try:
-        r = _throttle() or requests.get(FUTURES_BASE + "/fapi/v1/premiumIndex", timeout=10)
+        r = _throttle() or session.get(FUTURES_BASE + "/fapi/v1/premiumIndex", timeout=10)
         if r.status_code in (418, 429):
             _trip_ban(r); return {}
         if r.status_code != 200: return {}
@@ -184,7 +285,7 @@ def fetch_oi_change(symbol: str, period: str = "1h", limit: int = 25):
     if _rate_limited():
         return None
     try:
-        r = _throttle() or requests.get(FUTURES_BASE + "/futures/data/openInterestHist",
+        r = _throttle() or session.get(FUTURES_BASE + "/futures/data/openInterestHist",
                          params={"symbol": symbol, "period": period, "limit": limit}, timeout=5)
         if r.status_code in (418, 429):
             _trip_ban(r); return None
@@ -207,7 +308,7 @@ def fetch_taker_ratio(symbol: str, period: str = "5m", limit: int = 6) -> dict:
     if _rate_limited():
         return None
     try:
-        r = _throttle() or requests.get(FUTURES_BASE + "/futures/data/takerlongshortRatio",
+        r = _throttle() or session.get(FUTURES_BASE + "/futures/data/takerlongshortRatio",
                          params={"symbol": symbol, "period": period, "limit": limit},
                          timeout=5)
         if r.status_code in (418, 429):
@@ -259,7 +360,7 @@ def fetch_long_short_ratio(symbol: str, period: str = "5m", limit: int = 6) -> d
     if _rate_limited():
         return None
     try:
-        r = _throttle() or requests.get(FUTURES_BASE + "/futures/data/globalLongShortAccountRatio",
+        r = _throttle() or session.get(FUTURES_BASE + "/futures/data/globalLongShortAccountRatio",
                          params={"symbol": symbol, "period": period, "limit": limit},
                          timeout=5)
         if r.status_code in (418, 429):
@@ -309,7 +410,7 @@ def fetch_order_book_imbalance(symbol: str, limit: int = 50) -> dict:
     if _rate_limited():
         return None
     try:
-        r = _throttle() or requests.get(FUTURES_BASE + "/fapi/v1/depth",
+        r = _throttle() or session.get(FUTURES_BASE + "/fapi/v1/depth",
                          params={"symbol": symbol, "limit": limit},
                          timeout=5)
         if r.status_code in (418, 429):
@@ -357,8 +458,28 @@ def fetch_order_book_imbalance(symbol: str, limit: int = 50) -> dict:
         return None
 
 
+# BTC context không phụ thuộc symbol — scan fan-out gọi lại cho từng coin (3 call/lần).
+# Cache 60s toàn process; chỉ cache kết quả thành công (price != None).
+BTC_CTX_TTL = 60
+_btc_ctx_cache = (0.0, None)   # (ts, ctx) — gán nguyên tử
+_btc_ctx_lock  = _threading.Lock()
+
 def fetch_btc_context() -> dict:
-    """BTC market sentiment — dùng để warn khi LONG altcoin lúc BTC bear."""
+    """BTC market sentiment — dùng để warn khi LONG altcoin lúc BTC bear. Cache BTC_CTX_TTL."""
+    global _btc_ctx_cache
+    ts, ctx = _btc_ctx_cache
+    if ctx is not None and _time.time() - ts < BTC_CTX_TTL:
+        return dict(ctx)
+    with _btc_ctx_lock:   # nhiều thread cùng miss → chỉ 1 thread fetch, còn lại dùng kết quả
+        ts, ctx = _btc_ctx_cache
+        if ctx is not None and _time.time() - ts < BTC_CTX_TTL:
+            return dict(ctx)
+        ctx = _compute_btc_context()
+        if ctx.get("price") is not None:
+            _btc_ctx_cache = (_time.time(), ctx)
+    return dict(ctx)
+
+def _compute_btc_context() -> dict:
     try:
         df_d1 = fetch_klines("BTCUSDT", "1d", 50)
         df_h4 = fetch_klines("BTCUSDT", "4h", 100)
@@ -2,6 +2,8 @@
 import numpy as np
 import pandas as pd
 
+from core.utils import HAS_NUMBA, njit
+
 
 def add_ma(df: pd.DataFrame) -> pd.DataFrame:
     for p in [34, 89, 200]:
@@ -99,23 +101,78 @@ def prepare(df: pd.DataFrame) -> pd.DataFrame:
     return df.dropna(subset=["ma34"])
 
 
-def ma_slope(series: pd.Series, n: int = 5) -> str:
-    if len(series) < n: return "FLAT"
-    chg = (series.iloc[-1] - series.iloc[-n]) / series.iloc[-n] * 100
+def _slope_label(chg) -> str:
     if chg > 0.15:  return "UP"
     if chg < -0.15: return "DOWN"
     return "FLAT"
 
 
+def ma_slope(series: pd.Series, n: int = 5) -> str:
+    if len(series) < n: return "FLAT"
+    a = series.to_numpy() if isinstance(series, pd.Series) else series   # tránh 2 lần .iloc
+    return _slope_label((a[-1] - a[-n]) / a[-n] * 100)
+
+
+def ma_slopes(df: pd.DataFrame, cols, n: int = 5) -> list:
+    """ma_slope cho nhiều cột 1 lúc: 1 lần to_numpy, tính % thay đổi vector trên 2 hàng."""
+    if len(df) < n: return ["FLAT"] * len(cols)
+    a = df[list(cols)].to_numpy(dtype=np.float64)
+    chg = (a[-1] - a[-n]) / a[-n] * 100
+    return [_slope_label(c) for c in chg]
+
+
+@njit(cache=True, nogil=True)   # có numba: nhả GIL → các worker scan tính song song thật
+def _swing_flags(high, low, lookback):
+    """Kernel swing point: nến i là swing high nếu high[i] = max cửa sổ ±lookback
+    (low tương tự). NaN trong cửa sổ bị bỏ qua như pandas .max()/.min()."""
+    n = len(high)
+    is_high = np.zeros(n, dtype=np.bool_)
+    is_low  = np.zeros(n, dtype=np.bool_)
+    for i in range(lookback, n - lookback):
+        hi = high[i]
+        lo = low[i]
+        ok_h = hi == hi   # NaN → không phải swing
+        ok_l = lo == lo
+        for j in range(i - lookback, i + lookback + 1):
+            if high[j] > hi:
+                ok_h = False
+            if low[j] < lo:
+                ok_l = False
+            if not ok_h and not ok_l:
+                break
+        is_high[i] = ok_h
+        is_low[i]  = ok_l
+    return is_high, is_low
+
+
+def _swing_flags_np(high, low, lookback):
+    """Bản numpy (sliding window) của _swing_flags — dùng khi không có numba,
+    vì vòng lặp kernel chạy Python thuần còn chậm hơn bản pandas cũ."""
+    n = len(high)
+    is_high = np.zeros(n, dtype=np.bool_)
+    is_low  = np.zeros(n, dtype=np.bool_)
+    w = 2 * lookback + 1
+    if n < w:
+        return is_high, is_low
+    from numpy.lib.stride_tricks import sliding_window_view
+    # NaN → ±inf để max/min bỏ qua NaN như pandas; nến giữa NaN so sánh ra False
+    win_h = sliding_window_view(np.where(np.isnan(high), -np.inf, high), w).max(axis=1)
+    win_l = sliding_window_view(np.where(np.isnan(low),   np.inf, low),  w).min(axis=1)
+    is_high[lookback:n - lookback] = high[lookback:n - lookback] == win_h
+    is_low[lookback:n - lookback]  = low[lookback:n - lookback]  == win_l
+    return is_high, is_low
+
+
 def find_swing_points(df: pd.DataFrame, lookback: int = 5):
-    highs, lows = [], []
-    for i in range(lookback, len(df) - lookback):
-        window_h = df["high"].iloc[i - lookback: i + lookback + 1]
-        window_l = df["low"].iloc[i - lookback: i + lookback + 1]
-        if df["high"].iloc[i] == window_h.max():
-            highs.append((df.index[i], float(df["high"].iloc[i])))
-        if df["low"].iloc[i] == window_l.min():
-            lows.append((df.index[i], float(df["low"].iloc[i])))
+    high = df["high"].to_numpy(dtype=np.float64)
+    low  = df["low"].to_numpy(dtype=np.float64)
+    if HAS_NUMBA:
+        is_high, is_low = _swing_flags(high, low, lookback)
+    else:
+        is_high, is_low = _swing_flags_np(high, low, lookback)
+    idx = df.index
+    highs = [(idx[i], float(high[i])) for i in np.flatnonzero(is_high)]
+    lows  = [(idx[i], float(low[i]))  for i in np.flatnonzero(is_low)]
     return highs, lows
 
 
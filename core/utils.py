@@ -1,13 +1,78 @@
 """utils.py — Shared utilities: JSON, sanitize, smart_round"""
+import json
 import math
+import threading
+import time
 import numpy as np
 import pandas as pd
 from flask.json.provider import DefaultJSONProvider
 
+try:
+    from numba import njit
+    HAS_NUMBA = True
+except ImportError:
+    # numba là optional — không có thì kernel chạy Python thuần, kết quả giống hệt
+    HAS_NUMBA = False
+    def njit(*args, **kwargs):
+        if len(args) == 1 and callable(args[0]) and not kwargs:
+            return args[0]
+        return lambda fn: fn
+
+try:
+    import orjson
+    HAS_ORJSON = True
+except ImportError:
+    # orjson là optional — không có thì dùng json stdlib, output tương đương
+    HAS_ORJSON = False
+
+
+def _orjson_default(default):
+    # orjson không nhận float subclass (np.float64) → trả float thường như json stdlib
+    def _fn(o):
+        if isinstance(o, float):
+            return float(o)
+        if default is None:
+            raise TypeError(f"Type is not JSON serializable: {type(o).__name__}")
+        return default(o)
+    return _fn
+
+
+def json_dumps(obj, indent=False, sort_keys=False, default=None) -> str:
+    """json.dumps nhanh (orjson nếu có). datetime đi qua `default` như stdlib; key int → str.
+    Khác stdlib: NaN → null, ký tự non-ASCII ghi thẳng UTF-8 (không escape \\uXXXX)."""
+    if HAS_ORJSON:
+        opt = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+        if indent:    opt |= orjson.OPT_INDENT_2
+        if sort_keys: opt |= orjson.OPT_SORT_KEYS
+        try:
+            return orjson.dumps(obj, default=_orjson_default(default), option=opt).decode()
+        except TypeError:
+            pass  # int > 64-bit… → để stdlib xử lý / raise đúng lỗi cũ
+    return json.dumps(obj, indent=2 if indent else None, sort_keys=sort_keys, default=default)
+
+
+def json_loads(s):
+    """json.loads nhanh (orjson nếu có) — nhận str/bytes. File cũ có NaN/Infinity
+    (orjson từ chối) → fallback stdlib."""
+    if HAS_ORJSON:
+        try:
+            return orjson.loads(s)
+        except ValueError:
+            pass
+    return json.loads(s)
+
 
 class NumpyJSONProvider(DefaultJSONProvider):
     def dumps(self, obj, **kwargs):
-        return super().dumps(self._convert(obj), **kwargs)
+        obj = self._convert(obj)
+        if HAS_ORJSON:
+            return json_dumps(obj, indent=bool(kwargs.get("indent")),
+                              sort_keys=kwargs.get("sort_keys", self.sort_keys),
+                              default=kwargs.get("default", self.default))
+        return super().dumps(obj, **kwargs)
+
+    def loads(self, s, **kwargs):
+        return json_loads(s) if not kwargs else super().loads(s, **kwargs)
 
     def _convert(self, obj):
         if isinstance(obj, dict):   return {k: self._convert(v) for k, v in obj.items()}
@@ -25,6 +90,8 @@ class NumpyJSONProvider(DefaultJSONProvider):
 
 def sanitize(obj):
     """Đệ quy convert numpy/pandas types → Python native trước jsonify."""
+    t = type(obj)
+    if t is str or t is int or obj is None: return obj   # fast-path: phần lớn leaf
     if isinstance(obj, dict):   return {k: sanitize(v) for k, v in obj.items()}
     if isinstance(obj, list):   return [sanitize(i) for i in obj]
     if isinstance(obj, (bool, np.bool_)): return bool(obj)
@@ -38,6 +105,43 @@ def sanitize(obj):
     return obj
 
 
+class AnalyzeCache:
+    """Cache TTL kết quả engine theo (tên engine, symbol, force_futures, phút hiện tại).
+    Gọi lại trong cùng phút và còn trong TTL → trả shallow copy (caller hay gắn thêm key
+    như algo, tier…), không chạy lại engine. Lỗi/exception không cache. Key không chứa
+    cfg → mỗi nơi dùng cfg khác nhau (dashboard vs scanner) giữ 1 instance riêng và
+    clear() khi cfg đổi."""
+
+    def __init__(self, ttl: float = 55):
+        self.ttl     = ttl
+        self._data   = {}   # key -> (ts, result)
+        self._lock   = threading.Lock()
+        self._bucket = 0
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __call__(self, engine_fn, sym: str, cfg: dict) -> dict:
+        now    = time.time()
+        bucket = int(now // 60)
+        key    = (getattr(engine_fn, "__name__", repr(engine_fn)), sym,
+                  bool(cfg.get("force_futures", False)), bucket)
+        hit = self._data.get(key)
+        if hit is not None and now - hit[0] < self.ttl:
+            return dict(hit[1])
+        result = engine_fn(sym, cfg)
+        if isinstance(result, dict) and not result.get("error"):
+            with self._lock:
+                if bucket != self._bucket:   # sang phút mới → dọn bucket cũ
+                    for k in [k for k in self._data if k[3] < bucket]:
+                        del self._data[k]
+                    self._bucket = bucket
+                self._data[key] = (now, result)
+            return dict(result)
+        return result
+
+
 def smart_round(val):
     """Round thông minh theo magnitude — tránh 0.1679 bị round thành 0.17"""
     if not val: return 0
@@ -52,6 +156,59 @@ def smart_round(val):
         return round(val, 6)
 
 
+def round_arr(a, ndigits) -> np.ndarray:
+    """round() cho cả mảng, kết quả y hệt round(float(x), n) của Python từng phần tử.
+    np.round(x*10^n) chỉ lệch Python (làm tròn đúng trên giá trị nhị phân) khi x*10^n
+    sát .5 → các phần tử đó tính lại bằng round() scalar. ndigits: int hoặc mảng int."""
+    a = np.asarray(a, dtype=np.float64)
+    nd = np.broadcast_to(np.asarray(ndigits), a.shape)
+    scale = np.power(10.0, nd)
+    with np.errstate(invalid="ignore", over="ignore"):
+        scaled = a * scale
+        out = np.rint(scaled) / scale
+        near_tie = np.abs(scaled - np.floor(scaled) - 0.5) < 1e-6
+    for i in np.flatnonzero(near_tie):
+        out.flat[i] = round(float(a.flat[i]), int(nd.flat[i]))
+    return out
+
+
+def smart_round_arr(a) -> np.ndarray:
+    """smart_round cho cả mảng (cột nến chart…) — cùng bậc magnitude và cùng kết quả với
+    smart_round từng phần tử; riêng 0 trả 0.0 (float) thay vì int 0."""
+    a = np.asarray(a, dtype=np.float64)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        lg  = np.log10(np.abs(a))
+        mag = np.floor(lg)
+    nd = np.select([mag >= 2, mag >= 0, mag >= -2, mag >= -4], [2, 3, 5, 6], 8)
+    # NaN/inf: smart_round rơi vào nhánh except → round(val, 6)
+    nd[~np.isfinite(lg)] = 6
+    out = round_arr(a, nd)
+    out[a == 0] = 0.0
+    # log10 numpy vs math có thể lệch 1 ulp sát lũy thừa 10 → bậc magnitude khác nhau;
+    # các phần tử đó dùng lại smart_round scalar cho chắc
+    with np.errstate(invalid="ignore"):
+        edge = np.flatnonzero(np.isfinite(lg) & (np.abs(lg - np.rint(lg)) < 1e-9))
+    for i in edge:
+        out[i] = smart_round(float(a[i]))
+    return out
+
+
+def chart_candles(df, ma_cols=("ma34", "ma89", "ma200"), n: int = 80) -> list:
+    """N nến cuối của df → list dict cho chart frontend {t(ms), o, h, l, c, v, ma34, ma89,
+    ma200, vol_ratio}. ma_cols: cột đổ vào 3 slot MA (scalp dùng EMA9/EMA21/MA34).
+    Làm tròn theo cột (smart_round_arr/round_arr) rồi zip — không iterrows, không gọi
+    smart_round từng ô."""
+    tail = df.tail(n)
+    t_ms = (tail.index.as_unit("ns").asi8 // 10**6).tolist()
+    px   = [smart_round_arr(tail[c].to_numpy(dtype=np.float64)).tolist()
+            for c in ("open", "high", "low", "close", *ma_cols)]
+    v    = round_arr(tail["volume"].to_numpy(dtype=np.float64), 2).tolist()
+    vr   = round_arr(tail["vol_ratio"].to_numpy(dtype=np.float64), 2).tolist()
+    return [{"t": t, "o": o, "h": h, "l": l, "c": c, "v": vv,
+             "ma34": m1, "ma89": m2, "ma200": m3, "vol_ratio": r}
+            for t, o, h, l, c, m1, m2, m3, vv, r in zip(t_ms, *px, v, vr)]
+
+
 def recommended_size(confidence, rr, direction=None, funding=None, atr_state=None):
     """Đề xuất % vốn account cho 1 lệnh dựa trên confidence + RR + market context.
 
@@ -1,16 +1,19 @@
 """dashboard/engine.py — FAM Signal Engine. Chỉ sửa file này khi thay đổi logic Dashboard."""
 import math
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timezone, timedelta
 
 _TZ_VN = timezone(timedelta(hours=7))
 
 from core.binance import (fetch_klines, fetch_funding_rate,
                            fetch_oi_change, fetch_btc_context)
-from core.indicators import (prepare, ma_slope, find_swing_points,
+from core.indicators import (prepare, ma_slope, ma_slopes, find_swing_points,
                               classify_structure, fib_retracement,
                               fib_extension, is_no_trade_zone, calc_atr_context,
                               weekly_macro_bias)
-from core.utils import sanitize, smart_round, recommended_size, short_context_check
+from core.utils import (sanitize, smart_round, recommended_size, short_context_check,
+                        chart_candles)
 
 
 def _interpret_funding(funding, oi_change, direction):
@@ -41,13 +44,169 @@ def _interpret_funding(funding, oi_change, direction):
     return warnings, adj
 
 
+# Pool I/O dùng chung cho phần fetch đầu fam_analyze — 7 call độc lập chạy song song
+# (throttle toàn cục trong core.binance vẫn giãn nhịp, nhưng RTT chồng lên nhau).
+_FETCH_POOL = ThreadPoolExecutor(max_workers=8, thread_name_prefix="fam-fetch")
+
+def _fetch_prepared(symbol: str, interval: str, limit: int, ff: bool):
+    """fetch_klines + prepare trong cùng task pool: frame nào về trước tính indicator trước,
+    chồng lên thời gian chờ mạng của các call còn lại."""
+    return prepare(fetch_klines(symbol, interval, limit, force_futures=ff))
+
+
+def _gather_inputs(symbol: str, ff: bool, btc_ctx: dict = None, funding_map: dict = None) -> dict:
+    """Fetch song song klines W/D1/H4/H1 (đã prepare) + funding + OI + BTC context (bỏ qua
+    btc/funding nếu caller đã có sẵn). Lỗi klines raise như khi gọi tuần tự (W → D1 → H4 → H1).
+    H4 fetch thẳng 300 nến, KHÔNG gộp từ 1h: chart 80 nến cuối cần MA200 đủ cửa sổ →
+    cần ~(80+199)×4 nến 1h, nặng weight hơn chính call 4h."""
+    futs = {
+        "w":       _FETCH_POOL.submit(_fetch_prepared, symbol, "1w", 250, ff),
+        "d1":      _FETCH_POOL.submit(_fetch_prepared, symbol, "1d", 300, ff),
+        "h4":      _FETCH_POOL.submit(_fetch_prepared, symbol, "4h", 300, ff),
+        "h1":      _FETCH_POOL.submit(_fetch_prepared, symbol, "1h", 150, ff),
+        "oi":      _FETCH_POOL.submit(fetch_oi_change, symbol),
+    }
+    has_funding = bool(funding_map) and symbol in funding_map
+    if not has_funding:
+        futs["funding"] = _FETCH_POOL.submit(fetch_funding_rate, symbol)
+    if not btc_ctx:
+        futs["btc"] = _FETCH_POOL.submit(fetch_btc_context)
+    try:
+        out = {k: f.result() for k, f in futs.items()}
+        out.setdefault("btc", btc_ctx)
+        if has_funding:
+            out["funding"] = funding_map[symbol]
+        return out
+    except Exception:
+        for f in futs.values():
+            f.cancel()   # call chưa chạy thì bỏ — kết quả không dùng tới
+        raise
+
+
+def _first_in_band(levels, lo: float, hi: float):
+    """Level đầu tiên (theo thứ tự ưu tiên truyền vào) nằm trong (lo, hi); None nếu không có.
+    Dùng chung cho TP1 LONG/SHORT — KHÔNG sort theo khoảng cách, giữ ưu tiên MA34 → 89 → 200."""
+    return next((v for v in levels if lo < v < hi), None)
+
+
+def _checklist_verdict(ok_count: int, fail_count: int, confidence: str, h1_status: str) -> str:
+    """Verdict GO/WAIT/NO từ số check đạt/trượt, rồi override theo confidence và H1."""
+    if fail_count >= 2:
+        verdict = "NO"
+    elif fail_count == 0 and ok_count >= 4:
+        verdict = "GO"
+    else:
+        verdict = "WAIT"
+
+    # Override theo confidence
+    if confidence == "LOW":
+        verdict = "NO" if fail_count >= 1 else "WAIT"
+    elif confidence == "MEDIUM":
+        if verdict == "GO": verdict = "WAIT"  # MEDIUM tối đa WAIT
+    # H1 chưa rõ → không GO
+    if h1_status in ("FORMING", "COUNTER"):
+        if verdict == "GO": verdict = "WAIT"
+    return verdict
+
+
+def build_entry_checklist(direction, h1_status, rr, funding, oi_change, btc_ctx, no_trade, confidence="LOW"):
+    """Entry checklist tự động → (checks, verdict GO/WAIT/NO). Hàm thuần, chỉ phụ thuộc
+    tham số — đặt ở module thay vì closure dựng lại mỗi lần fam_analyze chạy."""
+    checks = []
+    dir_vn = "LONG" if direction == "LONG" else "SHORT"
+
+    # 1. Confidence
+    if confidence == "HIGH":
+        checks.append({"ok": True,  "text": "Confidence HIGH — tín hiệu đa khung đủ mạnh"})
+    elif confidence == "MEDIUM":
+        checks.append({"ok": False, "text": "Confidence MEDIUM — chờ thêm 1-2 nến H4 xác nhận rõ hướng"})
+    else:
+        checks.append({"ok": False, "text": "Confidence LOW — tín hiệu yếu, không vào lệnh"})
+
+    # 2. H1 confirmation
+    if h1_status == "CONFIRMED":
+        checks.append({"ok": True,  "text": "H1 đang chạy đúng hướng " + dir_vn + " — momentum tốt"})
+    elif h1_status == "PULLBACK":
+        checks.append({"ok": None,  "text": "H1 đang pullback — chờ nến H1 tiếp theo đóng cửa theo hướng " + dir_vn})
+    elif h1_status == "COUNTER":
+        checks.append({"ok": False, "text": "H1 đang ngược chiều " + dir_vn + " — không vào, chờ H1 đổi hướng"})
+    else:
+        checks.append({"ok": None,  "text": "H1 chưa xác nhận — chờ nến H1 đóng cửa rõ hướng " + dir_vn})
+
+    # 3. No-trade zone
+    if not no_trade:
+        checks.append({"ok": True,  "text": "Giá nằm ngoài vùng MA34/89 — tín hiệu rõ hướng"})
+    else:
+        checks.append({"ok": None,  "text": "Giá kẹt giữa MA34-MA89 — chờ giá thoát hẳn ra ngoài vùng này"})
+
+    # 4. R:R
+    if rr >= 2.0:
+        checks.append({"ok": True,  "text": f"R:R 1:{rr} — rủi ro/lợi nhuận tốt (≥ 1:2)"})
+    elif rr >= 1.5:
+        checks.append({"ok": True,  "text": f"R:R 1:{rr} — chấp nhận được (≥ 1:1.5)"})
+    elif rr >= 1.0:
+        checks.append({"ok": None,  "text": f"R:R 1:{rr} — thấp, cân nhắc chờ giá về gần entry hơn"})
+    else:
+        checks.append({"ok": False, "text": f"R:R 1:{rr} < 1:1 — không vào, rủi ro cao hơn lợi nhuận"})
+
+    # 5. Funding
+    if funding is not None:
+        if direction == "LONG":
+            if funding < -0.01:
+                checks.append({"ok": True,  "text": f"Funding {funding:+.4f}% âm — thị trường nghiêng SHORT, tốt cho LONG entry"})
+            elif funding > 0.05:
+                checks.append({"ok": False, "text": f"Funding {funding:+.4f}% quá cao — Long overcrowded, chờ funding về dưới 0.03%"})
+            else:
+                checks.append({"ok": None,  "text": f"Funding {funding:+.4f}% trung tính — không ảnh hưởng đáng kể, có thể vào"})
+        else:  # SHORT
+            if funding > 0.01:
+                checks.append({"ok": True,  "text": f"Funding {funding:+.4f}% dương — bạn được nhận phí khi giữ SHORT"})
+            elif funding < -0.05:
+                checks.append({"ok": False, "text": f"Funding {funding:+.4f}% âm sâu — Short overcrowded, chờ funding về trên -0.03%"})
+            else:
+                checks.append({"ok": None,  "text": f"Funding {funding:+.4f}% trung tính — không ảnh hưởng đáng kể, có thể vào"})
+
+    # 6. BTC context
+    sentiment = btc_ctx.get("sentiment", "NEUTRAL")
+    btc_chg   = btc_ctx.get("chg_24h", 0) or 0
+    if sentiment == "RISK_ON" and direction == "LONG":
+        checks.append({"ok": True,  "text": f"BTC đang BULL D1+H4 — thị trường thuận, LONG altcoin có lợi"})
+    elif sentiment in ("RISK_OFF", "DUMP") and direction == "SHORT":
+        checks.append({"ok": True,  "text": f"BTC đang giảm ({btc_chg:+.1f}% 24h) — SHORT altcoin theo xu hướng thị trường"})
+    elif sentiment in ("RISK_OFF", "DUMP") and direction == "LONG":
+        checks.append({"ok": False, "text": f"BTC đang BEAR/DUMP ({btc_chg:+.1f}% 24h) — không LONG altcoin khi BTC giảm mạnh"})
+    elif sentiment == "RISK_ON" and direction == "SHORT":
+        checks.append({"ok": None,  "text": f"BTC đang BULL — SHORT ngược chiều thị trường, cần tín hiệu mã rất rõ"})
+    else:
+        checks.append({"ok": None,  "text": f"BTC sideways ({btc_chg:+.1f}% 24h) — không hỗ trợ cũng không cản, xét tín hiệu mã riêng"})
+
+    # 7. OI
+    if oi_change is not None:
+        if direction == "LONG":
+            if oi_change > 5:
+                checks.append({"ok": True,  "text": f"OI tăng +{oi_change}% — tiền đang đổ vào thị trường, hỗ trợ LONG"})
+            elif oi_change < -5:
+                checks.append({"ok": False, "text": f"OI giảm {oi_change}% — vị thế đang đóng, chờ OI ổn định hoặc tăng lại"})
+            else:
+                checks.append({"ok": None,  "text": f"OI {oi_change:+.1f}% — chưa có dòng tiền rõ, theo dõi thêm"})
+        else:  # SHORT
+            if oi_change < -5:
+                checks.append({"ok": True,  "text": f"OI giảm {oi_change}% — Long đang đóng vị thế, hỗ trợ SHORT"})
+            elif oi_change > 5:
+                checks.append({"ok": False, "text": f"OI tăng +{oi_change}% — Long đang vào mạnh, rủi ro SHORT bị squeeze, chờ OI chững lại"})
+            else:
+                checks.append({"ok": None,  "text": f"OI {oi_change:+.1f}% — chưa có tín hiệu dòng tiền rõ, theo dõi thêm"})
+
+    # ok chỉ nhận True/False/None → list.count đếm 1 lượt mỗi loại
+    oks = [c["ok"] for c in checks]
+    return checks, _checklist_verdict(oks.count(True), oks.count(False), confidence, h1_status)
+
+
 def fam_analyze(symbol: str, cfg: dict) -> dict:
     # ── Fetch data ──
     ff = bool(cfg.get("force_futures", False))
-    df_w  = prepare(fetch_klines(symbol, "1w", 250, force_futures=ff))
-    df_d1 = prepare(fetch_klines(symbol, "1d", 300, force_futures=ff))
-    df_h4 = prepare(fetch_klines(symbol, "4h", 300, force_futures=ff))
-    df_h1 = prepare(fetch_klines(symbol, "1h", 150, force_futures=ff))
+    inputs = _gather_inputs(symbol, ff, cfg.get("_btc_ctx"), cfg.get("_funding_map"))
+    df_w, df_d1, df_h4, df_h1 = inputs["w"], inputs["d1"], inputs["h4"], inputs["h1"]
 
     for df in [df_d1, df_h4, df_h1]:
         if len(df) < 10:
@@ -60,29 +219,38 @@ def fam_analyze(symbol: str, cfg: dict) -> dict:
         "ma34_slope": "FLAT", "ma89_slope": "FLAT", "ma34": None, "ma89": None, "ma200": None,
     }
 
-    price    = float(df_h1["close"].iloc[-1])
-    row_d1   = df_d1.iloc[-1]
+    # Cột H1 dùng nhiều lần → ndarray 1 lần, slice array thay vì mỗi .iloc dựng Series mới
+    h1_open  = df_h1["open"].to_numpy(dtype=np.float64)
+    h1_close = df_h1["close"].to_numpy(dtype=np.float64)
+    h1_high  = df_h1["high"].to_numpy(dtype=np.float64)
+    h1_low   = df_h1["low"].to_numpy(dtype=np.float64)
+    h1_atr   = df_h1["atr"].to_numpy(dtype=np.float64)
+
+    price    = float(h1_close[-1])
     row_h4   = df_h4.iloc[-1]
-    prev_h4  = df_h4.iloc[-2]
-    row_h1   = df_h1.iloc[-1]
+    # Ô hàng cuối D1/H4 đọc nhiều lần → unpack 1 lần thành float native thay vì
+    # mỗi row["col"] lại lookup index + box numpy scalar rồi float() lần nữa
+    d1_ma34, d1_ma89 = df_d1[["ma34", "ma89"]].to_numpy(dtype=np.float64)[-1].tolist()
+    (h4_prev_close, h4_prev_ma34, _, _), (h4_close, h4_ma34, h4_ma89, h4_ma200) = \
+        df_h4[["close", "ma34", "ma89", "ma200"]].to_numpy(dtype=np.float64)[-2:].tolist()
 
     # ── Fetch market data ──
-    funding   = fetch_funding_rate(symbol)
-    oi_change = fetch_oi_change(symbol)
+    funding   = inputs["funding"]
+    oi_change = inputs["oi"]
     atr_ctx   = calc_atr_context(df_h4, df_d1)
-    btc_ctx   = fetch_btc_context()
-    atr_h1    = float(df_h1["atr"].iloc[-1])
+    btc_ctx   = inputs["btc"]
+    atr_h1    = float(h1_atr[-1])
 
     # ────────────────────────────────────────
     # TẦNG 1 — D1 Bias
     # ────────────────────────────────────────
-    dist_ma34_d1  = (price - float(row_d1["ma34"])) / float(row_d1["ma34"]) * 100
-    dist_ma89_d1  = (price - float(row_d1["ma89"])) / float(row_d1["ma89"]) * 100
+    dist_ma34_d1  = (price - d1_ma34) / d1_ma34 * 100
+    dist_ma89_d1  = (price - d1_ma89) / d1_ma89 * 100
     far_from_ma   = abs(dist_ma34_d1) > 8 or abs(dist_ma89_d1) > 8
 
-    if price > row_d1["ma34"] and price > row_d1["ma89"]:
+    if price > d1_ma34 and price > d1_ma89:
         d1_bias = "LONG"
-    elif price < row_d1["ma34"] and price < row_d1["ma89"]:
+    elif price < d1_ma34 and price < d1_ma89:
         d1_bias = "SHORT"
     else:
         d1_bias = "NEUTRAL"
@@ -100,18 +268,16 @@ def fam_analyze(symbol: str, cfg: dict) -> dict:
     # ────────────────────────────────────────
     # TẦNG 2 — H4 Bias
     # ────────────────────────────────────────
-    h4_above_ma34 = bool(row_h4["close"] > row_h4["ma34"])
-    h4_above_ma89 = bool(row_h4["close"] > row_h4["ma89"])
-    h4_x_ma34_up  = bool(prev_h4["close"] <= prev_h4["ma34"] and row_h4["close"] > row_h4["ma34"])
-    h4_x_ma34_dn  = bool(prev_h4["close"] >= prev_h4["ma34"] and row_h4["close"] < row_h4["ma34"])
+    h4_above_ma34 = h4_close > h4_ma34
+    h4_above_ma89 = h4_close > h4_ma89
+    h4_x_ma34_up  = h4_prev_close <= h4_prev_ma34 and h4_close > h4_ma34
+    h4_x_ma34_dn  = h4_prev_close >= h4_prev_ma34 and h4_close < h4_ma34
 
     if h4_above_ma34 and h4_above_ma89:   h4_bias = "LONG"
     elif not h4_above_ma34 and not h4_above_ma89: h4_bias = "SHORT"
     else:                                  h4_bias = "NEUTRAL"
 
-    slope_ma34 = ma_slope(df_h4["ma34"])
-    slope_ma89 = ma_slope(df_h4["ma89"])
-    slope_ma200= ma_slope(df_h4["ma200"])
+    slope_ma34, slope_ma89, slope_ma200 = ma_slopes(df_h4, ("ma34", "ma89", "ma200"))
 
     highs_h4, lows_h4 = find_swing_points(df_h4, lookback=5)
     h4_structure = classify_structure(highs_h4, lows_h4)
@@ -128,8 +294,8 @@ def fam_analyze(symbol: str, cfg: dict) -> dict:
     # ────────────────────────────────────────
     no_trade, no_trade_detail = is_no_trade_zone(price, row_h4)
 
-    recent_h = float(df_h1["high"].iloc[-60:].max())
-    recent_l  = float(df_h1["low"].iloc[-60:].min())
+    recent_h = float(np.nanmax(h1_high[-60:]))
+    recent_l  = float(np.nanmin(h1_low[-60:]))
     fib_ret   = fib_retracement(recent_h, recent_l)
     sh, sl_   = recent_h, recent_l
     fib_ext   = fib_extension(sl_, sh, recent_l)
@@ -141,21 +307,20 @@ def fam_analyze(symbol: str, cfg: dict) -> dict:
 
     ma34_h1  = float(df_h1["ma34"].iloc[-1])
 
-    h1_bullish      = bool(row_h1["close"] > row_h1["open"])
-    h1_bearish      = bool(row_h1["close"] < row_h1["open"])
-    h1_breakout     = bool(row_h1["close"] > recent_h * 0.998)
-    vol_ratio       = float(row_h1["vol_ratio"])
+    h1_bullish      = bool(h1_close[-1] > h1_open[-1])
+    h1_bearish      = bool(h1_close[-1] < h1_open[-1])
+    h1_breakout     = price > recent_h * 0.998
+    vol_ratio       = float(df_h1["vol_ratio"].iat[-1])
     vol_confirm     = vol_ratio > 1.3
 
     # ── H1 Status — đánh giá momentum H1 cho entry decision ──
     h1_ma34_slope  = ma_slope(df_h1["ma34"], n=3)
-    h1_above_ma7   = float(row_h1["close"]) > float(df_h1["close"].rolling(7, min_periods=1).mean().iloc[-1])
-    h1_above_ma25  = float(row_h1["close"]) > float(df_h1["close"].rolling(25, min_periods=1).mean().iloc[-1])
+    # MA7/MA25 chỉ cần giá trị cuối → mean của đuôi array, không dựng rolling cả cột
+    h1_above_ma7   = float(h1_close[-1]) > float(np.nanmean(h1_close[-7:]))
+    h1_above_ma25  = float(h1_close[-1]) > float(np.nanmean(h1_close[-25:]))
 
     # Đếm nến đỏ/xanh 5 nến gần nhất H1
-    last5_closes = df_h1["close"].iloc[-5:].values
-    last5_opens  = df_h1["open"].iloc[-5:].values
-    bear_count   = sum(1 for i in range(5) if last5_closes[i] < last5_opens[i])
+    bear_count   = int(np.less(h1_close[-5:], h1_open[-5:]).sum())
     bull_count   = 5 - bear_count
 
     def get_h1_status(direction):
@@ -181,118 +346,6 @@ def fam_analyze(symbol: str, cfg: dict) -> dict:
 
     h1_status, h1_status_note = get_h1_status(d1_bias)
 
-    # Entry checklist tự động
-    def build_entry_checklist(direction, h1_status, rr, funding, oi_change, btc_ctx, no_trade, confidence="LOW"):
-        checks = []
-        dir_vn = "LONG" if direction == "LONG" else "SHORT"
-
-        # 1. Confidence
-        if confidence == "HIGH":
-            checks.append({"ok": True,  "text": "Confidence HIGH — tín hiệu đa khung đủ mạnh"})
-        elif confidence == "MEDIUM":
-            checks.append({"ok": False, "text": "Confidence MEDIUM — chờ thêm 1-2 nến H4 xác nhận rõ hướng"})
-        else:
-            checks.append({"ok": False, "text": "Confidence LOW — tín hiệu yếu, không vào lệnh"})
-
-        # 2. H1 confirmation
-        if h1_status == "CONFIRMED":
-            checks.append({"ok": True,  "text": "H1 đang chạy đúng hướng " + dir_vn + " — momentum tốt"})
-        elif h1_status == "PULLBACK":
-            checks.append({"ok": None,  "text": "H1 đang pullback — chờ nến H1 tiếp theo đóng cửa theo hướng " + dir_vn})
-        elif h1_status == "COUNTER":
-            checks.append({"ok": False, "text": "H1 đang ngược chiều " + dir_vn + " — không vào, chờ H1 đổi hướng"})
-        else:
-            checks.append({"ok": None,  "text": "H1 chưa xác nhận — chờ nến H1 đóng cửa rõ hướng " + dir_vn})
-
-        # 3. No-trade zone
-        if not no_trade:
-            checks.append({"ok": True,  "text": "Giá nằm ngoài vùng MA34/89 — tín hiệu rõ hướng"})
-        else:
-            checks.append({"ok": None,  "text": "Giá kẹt giữa MA34-MA89 — chờ giá thoát hẳn ra ngoài vùng này"})
-
-        # 4. R:R
-        if rr >= 2.0:
-            checks.append({"ok": True,  "text": f"R:R 1:{rr} — rủi ro/lợi nhuận tốt (≥ 1:2)"})
-        elif rr >= 1.5:
-            checks.append({"ok": True,  "text": f"R:R 1:{rr} — chấp nhận được (≥ 1:1.5)"})
-        elif rr >= 1.0:
-            checks.append({"ok": None,  "text": f"R:R 1:{rr} — thấp, cân nhắc chờ giá về gần entry hơn"})
-        else:
-            checks.append({"ok": False, "text": f"R:R 1:{rr} < 1:1 — không vào, rủi ro cao hơn lợi nhuận"})
-
-        # 5. Funding
-        if funding is not None:
-            if direction == "LONG":
-                if funding < -0.01:
-                    checks.append({"ok": True,  "text": f"Funding {funding:+.4f}% âm — thị trường nghiêng SHORT, tốt cho LONG entry"})
-                elif funding > 0.05:
-                    checks.append({"ok": False, "text": f"Funding {funding:+.4f}% quá cao — Long overcrowded, chờ funding về dưới 0.03%"})
-                else:
-                    checks.append({"ok": None,  "text": f"Funding {funding:+.4f}% trung tính — không ảnh hưởng đáng kể, có thể vào"})
-            else:  # SHORT
-                if funding > 0.01:
-                    checks.append({"ok": True,  "text": f"Funding {funding:+.4f}% dương — bạn được nhận phí khi giữ SHORT"})
-                elif funding < -0.05:
-                    checks.append({"ok": False, "text": f"Funding {funding:+.4f}% âm sâu — Short overcrowded, chờ funding về trên -0.03%"})
-                else:
-                    checks.append({"ok": None,  "text": f"Funding {funding:+.4f}% trung tính — không ảnh hưởng đáng kể, có thể vào"})
-
-        # 6. BTC context
-        sentiment = btc_ctx.get("sentiment", "NEUTRAL")
-        btc_chg   = btc_ctx.get("chg_24h", 0) or 0
-        if sentiment == "RISK_ON" and direction == "LONG":
-            checks.append({"ok": True,  "text": f"BTC đang BULL D1+H4 — thị trường thuận, LONG altcoin có lợi"})
-        elif sentiment in ("RISK_OFF", "DUMP") and direction == "SHORT":
-            checks.append({"ok": True,  "text": f"BTC đang giảm ({btc_chg:+.1f}% 24h) — SHORT altcoin theo xu hướng thị trường"})
-        elif sentiment in ("RISK_OFF", "DUMP") and direction == "LONG":
-            checks.append({"ok": False, "text": f"BTC đang BEAR/DUMP ({btc_chg:+.1f}% 24h) — không LONG altcoin khi BTC giảm mạnh"})
-        elif sentiment == "RISK_ON" and direction == "SHORT":
-            checks.append({"ok": None,  "text": f"BTC đang BULL — SHORT ngược chiều thị trường, cần tín hiệu mã rất rõ"})
-        else:
-            checks.append({"ok": None,  "text": f"BTC sideways ({btc_chg:+.1f}% 24h) — không hỗ trợ cũng không cản, xét tín hiệu mã riêng"})
-
-        # 7. OI
-        if oi_change is not None:
-            if direction == "LONG":
-                if oi_change > 5:
-                    checks.append({"ok": True,  "text": f"OI tăng +{oi_change}% — tiền đang đổ vào thị trường, hỗ trợ LONG"})
-                elif oi_change < -5:
-                    checks.append({"ok": False, "text": f"OI giảm {oi_change}% — vị thế đang đóng, chờ OI ổn định hoặc tăng lại"})
-                else:
-                    checks.append({"ok": None,  "text": f"OI {oi_change:+.1f}% — chưa có dòng tiền rõ, theo dõi thêm"})
-            else:  # SHORT
-                if oi_change < -5:
-                    checks.append({"ok": True,  "text": f"OI giảm {oi_change}% — Long đang đóng vị thế, hỗ trợ SHORT"})
-                elif oi_change > 5:
-                    checks.append({"ok": False, "text": f"OI tăng +{oi_change}% — Long đang vào mạnh, rủi ro SHORT bị squeeze, chờ OI chững lại"})
-                else:
-                    checks.append({"ok": None,  "text": f"OI {oi_change:+.1f}% — chưa có tín hiệu dòng tiền rõ, theo dõi thêm"})
-
-        # Verdict
-        ok_count   = sum(1 for c in checks if c["ok"] is True)
-        fail_count = sum(1 for c in checks if c["ok"] is False)
-        if fail_count >= 2:
-            verdict = "NO"
-        elif fail_count == 0 and ok_count >= 4:
-            verdict = "GO"
-        else:
-            verdict = "WAIT"
-
-        # Override theo confidence
-        if confidence == "LOW":
-            verdict = "NO" if fail_count >= 1 else "WAIT"
-        elif confidence == "MEDIUM":
-            if verdict == "GO": verdict = "WAIT"  # MEDIUM tối đa WAIT
-        # H1 chưa rõ → không GO
-        if h1_status in ("FORMING", "COUNTER"):
-            if verdict == "GO": verdict = "WAIT"
-
-        return checks, verdict
-
-    entry_checklist, entry_verdict = build_entry_checklist(
-        d1_bias, h1_status, 0, funding, oi_change, btc_ctx, no_trade, "LOW"
-    )  # rr=0 placeholder, confidence chưa có — sẽ recalc sau
-
     # ────────────────────────────────────────
     # DIRECTION & SCORING
     # ────────────────────────────────────────
@@ -393,14 +446,13 @@ def fam_analyze(symbol: str, cfg: dict) -> dict:
 
     # ── PATCH F: Abnormal Candle Spike Filter ──
     # Check cả nến cuối VÀ nến trước — spike có thể ở nến trước, nến sau chưa confirm
-    _spike_atr_avg = float(df_h1["atr"].iloc[-20:].mean()) if len(df_h1) >= 20 else atr_h1
+    _spike_atr_avg = float(np.nanmean(h1_atr[-20:])) if len(df_h1) >= 20 else atr_h1
     _spike_threshold = _spike_atr_avg * 2.0
     _spike_triggered = False
     _spike_body = 0.0
     _spike_which = ""
     for _si, _slabel in [(-1, "hiện tại"), (-2, "trước")]:
-        _sr = df_h1.iloc[_si]
-        _sb = abs(float(_sr["close"]) - float(_sr["open"]))
+        _sb = abs(float(h1_close[_si]) - float(h1_open[_si]))
         if _sb > _spike_threshold:
             _spike_triggered = True
             _spike_body = _sb
@@ -454,7 +506,7 @@ def fam_analyze(symbol: str, cfg: dict) -> dict:
     # OI tăng nhưng giá đang giảm = tiền vào SHORT, không phải LONG → block LONG
     # OI giảm nhưng giá đang tăng = tiền rời khỏi SHORT → block SHORT  
     if oi_change is not None and direction == "LONG" and oi_change > 3:
-        _price_chg_h1 = (float(df_h1["close"].iloc[-1]) - float(df_h1["close"].iloc[-4])) / float(df_h1["close"].iloc[-4]) * 100
+        _price_chg_h1 = (float(h1_close[-1]) - float(h1_close[-4])) / float(h1_close[-4]) * 100
         if _price_chg_h1 < -1.0:
             direction  = "WAIT"
             confidence = "LOW"
@@ -542,7 +594,7 @@ def fam_analyze(symbol: str, cfg: dict) -> dict:
     # Block LONG nếu giá tăng >10% trong 4h gần nhất (4 nến H1).
     # Block SHORT nếu giá giảm >10% trong 4h gần nhất.
     if len(df_h1) >= 5 and direction in ("LONG", "SHORT"):
-        _price_4h_ago = float(df_h1["close"].iloc[-5])
+        _price_4h_ago = float(h1_close[-5])
         if _price_4h_ago > 0:
             _chg_4h = (price - _price_4h_ago) / _price_4h_ago * 100
             if direction == "LONG" and _chg_4h > 10:
@@ -586,8 +638,8 @@ def fam_analyze(symbol: str, cfg: dict) -> dict:
     # ATR hiện tại > 2x ATR trung bình 20 nến H1 + giá xa EMA34 H1 > 4%
     # → block entry cùng chiều với move.
     if len(df_h1) >= 21 and direction in ("LONG", "SHORT") and ma34_h1 > 0:
-        _atr_avg_h1 = float(df_h1["atr"].iloc[-21:-1].mean())
-        _atr_now_h1 = float(df_h1["atr"].iloc[-1])
+        _atr_avg_h1 = float(np.nanmean(h1_atr[-21:-1]))
+        _atr_now_h1 = float(h1_atr[-1])
         _dist_ma34_pct = abs((price - ma34_h1) / ma34_h1 * 100)
         if _atr_avg_h1 > 0 and _atr_now_h1 > _atr_avg_h1 * 2 and _dist_ma34_pct > 4:
             _atr_ratio = _atr_now_h1 / _atr_avg_h1
@@ -605,8 +657,8 @@ def fam_analyze(symbol: str, cfg: dict) -> dict:
     # Case HUMAUSDT 29/04/2026: SHORT entry 0.0209 sát đáy 24h 0.020718 (~0.4%)
     # → cấu trúc đúng nhưng timing sai, dễ bounce trước khi reach TP1.
     if len(df_h1) >= 24 and direction in ("LONG", "SHORT"):
-        _high_24h = float(df_h1["high"].iloc[-24:].max())
-        _low_24h  = float(df_h1["low"].iloc[-24:].min())
+        _high_24h = float(np.nanmax(h1_high[-24:]))
+        _low_24h  = float(np.nanmin(h1_low[-24:]))
         if direction == "LONG" and _high_24h > 0:
             _dist_high_pct = (_high_24h - price) / price * 100
             if _dist_high_pct < 2:
@@ -634,10 +686,7 @@ def fam_analyze(symbol: str, cfg: dict) -> dict:
     #        nếu < 4% → block (TP1 gần như sát EMA200 = vô nghĩa)
     # LONG (mirror): nếu entry cách EMA200 H4 (phía trên) < 8% → giảm
     #               nếu < 4% → block
-    try:
-        _ma200_h4 = float(row_h4["ma200"])
-    except Exception:
-        _ma200_h4 = 0
+    _ma200_h4 = h4_ma200
     if _ma200_h4 > 0 and direction in ("LONG", "SHORT"):
         if direction == "SHORT" and price > _ma200_h4:
             _cushion_pct = (price - _ma200_h4) / price * 100
@@ -694,12 +743,10 @@ def fam_analyze(symbol: str, cfg: dict) -> dict:
     # ────────────────────────────────────────
     # SL / TP  (v3 — swing recent + Fib ext + entry optimal)
     # ────────────────────────────────────────
-    recent_h1_high = float(df_h1["high"].iloc[-20:].max())
-    recent_h1_low  = float(df_h1["low"].iloc[-20:].min())
+    recent_h1_high = float(np.nanmax(h1_high[-20:]))
+    recent_h1_low  = float(np.nanmin(h1_low[-20:]))
 
-    ma34_h4  = float(row_h4["ma34"])
-    ma89_h4  = float(row_h4["ma89"])
-    ma200_h4 = float(row_h4["ma200"])
+    ma34_h4, ma89_h4, ma200_h4 = h4_ma34, h4_ma89, h4_ma200
 
     # Swing H4 — chỉ lấy 30 nến gần đây (120h = 5 ngày) để tránh swing xa vô nghĩa
     df_h4_recent = df_h4.iloc[-30:]
@@ -732,9 +779,9 @@ def fam_analyze(symbol: str, cfg: dict) -> dict:
             return smart_round(min(candidates))
 
         # 2-4. MA theo thứ tự gần → xa
-        for ma in [ma34, ma89, ma200]:
-            if min_dist < ma < max_dist:
-                return smart_round(ma)
+        ma = _first_in_band((ma34, ma89, ma200), min_dist, max_dist)
+        if ma is not None:
+            return smart_round(ma)
 
         # 5. Fallback ATR — đảm bảo ≥ 2% dù không có level nào
         return smart_round(max(entry * 1.02, entry + atr * 3))
@@ -748,9 +795,9 @@ def fam_analyze(symbol: str, cfg: dict) -> dict:
         if candidates:
             return smart_round(max(candidates))
 
-        for ma in [ma34, ma89, ma200]:
-            if min_dist < ma < max_dist:
-                return smart_round(ma)
+        ma = _first_in_band((ma34, ma89, ma200), min_dist, max_dist)
+        if ma is not None:
+            return smart_round(ma)
 
         return smart_round(min(entry * 0.98, entry - atr * 3))
 
@@ -887,7 +934,7 @@ def fam_analyze(symbol: str, cfg: dict) -> dict:
         except Exception:
             pass
 
-    # Update checklist với rr thực
+    # Checklist dựng 1 lần, khi đã có rr + confidence thực
     entry_checklist, entry_verdict = build_entry_checklist(
         direction, h1_status, rr, funding, oi_change, btc_ctx, no_trade, confidence
     )
@@ -905,15 +952,7 @@ def fam_analyze(symbol: str, cfg: dict) -> dict:
         if entry_verdict == "GO": entry_verdict = "WAIT"  # MEDIUM tối đa WAIT
 
     # ── Candles cho chart ──
-    chart_df = df_h4.tail(80).reset_index()
-    candles  = [{"t": int(r["open_time"].timestamp() * 1000),
-                  "o": smart_round(r["open"]),  "h": smart_round(r["high"]),
-                  "l": smart_round(r["low"]),   "c": smart_round(r["close"]),
-                  "v": round(r["volume"], 2),
-                  "ma34": smart_round(r["ma34"]), "ma89": smart_round(r["ma89"]),
-                  "ma200": smart_round(r["ma200"]),
-                  "vol_ratio": round(r["vol_ratio"], 2)}
-                 for _, r in chart_df.iterrows()]
+    candles  = chart_candles(df_h4)
 
     result = {
         "symbol":       symbol,
@@ -971,7 +1010,7 @@ def fam_analyze(symbol: str, cfg: dict) -> dict:
         "swing_high": smart_round(sh),
         "swing_low":  smart_round(sl_),
         "candles":    candles,
-        "timestamp":  datetime.now(_TZ_VN).isoformat(),
+        "timestamp":  cfg.get("_scan_ts") or datetime.now(_TZ_VN).isoformat(),
         "h1_status":        h1_status,
         "h1_status_note":   h1_status_note,
         "entry_checklist":  entry_checklist,
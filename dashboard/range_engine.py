@@ -563,9 +563,9 @@ def range_analyze(symbol: str, cfg: dict) -> dict:
             raise ValueError(f"Không đủ data cho {symbol}")
 
     price     = float(df_h1["close"].iloc[-1])
-    funding   = fetch_funding_rate(symbol)
+    funding   = fetch_funding_rate(symbol, cfg.get("_funding_map"))
     oi_change = fetch_oi_change(symbol)
-    btc_ctx   = fetch_btc_context()
+    btc_ctx   = cfg.get("_btc_ctx") or fetch_btc_context()   # scan truyền sẵn 1 lần/scan
 
     # ── Market structure + BTC volume analysis ──
     ms        = _market_structure(df_h1, df_h4, df_d1, symbol)
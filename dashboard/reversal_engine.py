@@ -18,7 +18,7 @@ from core.binance import (fetch_klines, fetch_funding_rate,
                            fetch_order_book_imbalance)
 from core.indicators import (prepare, ma_slope, find_swing_points,
                               fib_retracement, fib_extension)
-from core.utils import sanitize, smart_round
+from core.utils import sanitize, smart_round, chart_candles
 
 _TZ_VN = timezone(timedelta(hours=7))
 
@@ -133,9 +133,9 @@ def reversal_analyze(symbol: str, cfg: dict) -> dict:
     row_m15  = df_m15.iloc[-1]
 
     # Market data
-    funding   = fetch_funding_rate(symbol)
+    funding   = fetch_funding_rate(symbol, cfg.get("_funding_map"))
     oi_change = fetch_oi_change(symbol)
-    btc_ctx   = fetch_btc_context()
+    btc_ctx   = cfg.get("_btc_ctx") or fetch_btc_context()   # scan truyền sẵn 1 lần/scan
     taker     = fetch_taker_ratio(symbol, period="5m", limit=6)
 
     atr_h1  = float(df_h1["atr"].iloc[-1])
@@ -478,15 +478,7 @@ def reversal_analyze(symbol: str, cfg: dict) -> dict:
         entry_verdict = "NO" if direction == "WAIT" else "WAIT"
 
     # ── Chart candles — H1 ──
-    chart_df = df_h1.tail(80).reset_index()
-    candles  = [{"t": int(r["open_time"].timestamp() * 1000),
-                  "o": smart_round(r["open"]),  "h": smart_round(r["high"]),
-                  "l": smart_round(r["low"]),   "c": smart_round(r["close"]),
-                  "v": round(r["volume"], 2),
-                  "ma34": smart_round(r["ma34"]), "ma89": smart_round(r["ma89"]),
-                  "ma200": smart_round(r["ma200"]),
-                  "vol_ratio": round(r["vol_ratio"], 2)}
-                 for _, r in chart_df.iterrows()]
+    candles  = chart_candles(df_h1)
 
     return sanitize({
         "symbol":        symbol,
@@ -547,7 +539,7 @@ def reversal_analyze(symbol: str, cfg: dict) -> dict:
         "swing_high": smart_round(float(df_h1["high"].iloc[-20:].max())),
         "swing_low":  smart_round(float(df_h1["low"].iloc[-20:].min())),
         "candles":    candles,
-        "timestamp":  datetime.now(_TZ_VN).isoformat(),
+        "timestamp":  cfg.get("_scan_ts") or datetime.now(_TZ_VN).isoformat(),
         "h1_status":       "REVERSAL",
         "h1_status_note":  f"Mean reversion signal — score {score}",
         "entry_checklist":  [],
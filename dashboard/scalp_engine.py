@@ -28,7 +28,8 @@ from core.binance import (fetch_klines, fetch_funding_rate,
 from core.indicators import (prepare, ma_slope, find_swing_points,
                               classify_structure, fib_retracement,
                               fib_extension, calc_atr_context)
-from core.utils import sanitize, smart_round, recommended_size, short_context_check
+from core.utils import (sanitize, smart_round, recommended_size, short_context_check,
+                        chart_candles)
 
 
 def scalp_analyze(symbol: str, cfg: dict) -> dict:
@@ -54,9 +55,9 @@ def scalp_analyze(symbol: str, cfg: dict) -> dict:
     prev_m5  = df_m5.iloc[-2]
 
     # Market data
-    funding   = fetch_funding_rate(symbol)
+    funding   = fetch_funding_rate(symbol, cfg.get("_funding_map"))
     oi_change = fetch_oi_change(symbol)
-    btc_ctx   = fetch_btc_context()
+    btc_ctx   = cfg.get("_btc_ctx") or fetch_btc_context()   # scan truyền sẵn 1 lần/scan
     atr_m15   = float(df_m15["atr"].iloc[-1])
     atr_m5    = float(df_m5["atr"].iloc[-1])
 
@@ -824,16 +825,8 @@ def scalp_analyze(symbol: str, cfg: dict) -> dict:
     if direction == "WAIT": entry_verdict = "WAIT"
 
     # ── Chart candles — dùng M15 ──
-    chart_df = df_m15.tail(80).reset_index()
-    candles  = [{"t": int(r["open_time"].timestamp() * 1000),
-                  "o": smart_round(r["open"]),  "h": smart_round(r["high"]),
-                  "l": smart_round(r["low"]),   "c": smart_round(r["close"]),
-                  "v": round(r["volume"], 2),
-                  "ma34":  smart_round(r["ema9"]),    # slot ma34 = EMA9 cho scalp
-                  "ma89":  smart_round(r["ema21"]),   # slot ma89 = EMA21 cho scalp
-                  "ma200": smart_round(r["ma34"]),    # slot ma200 = MA34 H1 context
-                  "vol_ratio": round(r["vol_ratio"], 2)}
-                 for _, r in chart_df.iterrows()]
+    # slot ma34 = EMA9, ma89 = EMA21, ma200 = MA34 (H1 context) cho scalp
+    candles  = chart_candles(df_m15, ma_cols=("ema9", "ema21", "ma34"))
 
     _size = recommended_size(confidence, rr, direction,
                               funding=funding, atr_state=atr_state)
@@ -901,7 +894,7 @@ def scalp_analyze(symbol: str, cfg: dict) -> dict:
         "swing_high": smart_round(recent_m15_high),
         "swing_low":  smart_round(recent_m15_low),
         "candles":    candles,
-        "timestamp":  datetime.now(_TZ_VN).isoformat(),
+        "timestamp":  cfg.get("_scan_ts") or datetime.now(_TZ_VN).isoformat(),
         "h1_status":       m5_status,
         "h1_status_note":  m5_note,
         "entry_checklist": entry_checklist,
@@ -20,11 +20,12 @@ _TZ_VN = timezone(timedelta(hours=7))
 
 from core.binance import (fetch_klines, fetch_funding_rate,
                            fetch_oi_change, fetch_btc_context)
-from core.indicators import (prepare, ma_slope, find_swing_points,
+from core.indicators import (prepare, ma_slopes, find_swing_points,
                               classify_structure, fib_retracement,
                               fib_extension, is_no_trade_zone, calc_atr_context,
                               detect_exhaustion_short)
-from core.utils import sanitize, smart_round, recommended_size, short_context_check
+from core.utils import (sanitize, smart_round, recommended_size, short_context_check,
+                        chart_candles)
 
 
 def swing_h1_analyze(symbol: str, cfg: dict) -> dict:
@@ -49,9 +50,9 @@ def swing_h1_analyze(symbol: str, cfg: dict) -> dict:
     row_m15 = df_m15.iloc[-1]
 
     # Market data
-    funding   = fetch_funding_rate(symbol)
+    funding   = fetch_funding_rate(symbol, cfg.get("_funding_map"))
     oi_change = fetch_oi_change(symbol)
-    btc_ctx   = fetch_btc_context()
+    btc_ctx   = cfg.get("_btc_ctx") or fetch_btc_context()   # scan truyền sẵn 1 lần/scan
     atr_ctx   = calc_atr_context(df_h4, df_h4)  # dùng H4 làm base
     atr_h1    = float(df_h1["atr"].iloc[-1])
     atr_m15   = float(df_m15["atr"].iloc[-1])
@@ -71,8 +72,7 @@ def swing_h1_analyze(symbol: str, cfg: dict) -> dict:
     else:
         h4_bias = "NEUTRAL"
 
-    slope_h4_ma34 = ma_slope(df_h4["ma34"])
-    slope_h4_ma89 = ma_slope(df_h4["ma89"])
+    slope_h4_ma34, slope_h4_ma89 = ma_slopes(df_h4, ("ma34", "ma89"))
     highs_h4, lows_h4 = find_swing_points(df_h4, lookback=5)
     h4_structure  = classify_structure(highs_h4, lows_h4)
 
@@ -85,8 +85,7 @@ def swing_h1_analyze(symbol: str, cfg: dict) -> dict:
     h1_x_ma34_dn  = prev_h1["close"] >= prev_h1["ma34"] and row_h1["close"] < row_h1["ma34"]
     h1_x_ma89_up  = prev_h1["close"] <= prev_h1["ma89"] and row_h1["close"] > row_h1["ma89"]
 
-    slope_h1_ma34 = ma_slope(df_h1["ma34"])
-    slope_h1_ma89 = ma_slope(df_h1["ma89"])
+    slope_h1_ma34, slope_h1_ma89 = ma_slopes(df_h1, ("ma34", "ma89"))
 
     highs_h1, lows_h1 = find_swing_points(df_h1, lookback=3)
     h1_structure  = classify_structure(highs_h1, lows_h1)
@@ -671,15 +670,7 @@ def swing_h1_analyze(symbol: str, cfg: dict) -> dict:
         entry_verdict = "NO" if rr < 1.0 else "WAIT"
 
     # ── Chart candles (H1 thay vì H4) ──
-    chart_df = df_h1.tail(80).reset_index()
-    candles  = [{"t": int(r["open_time"].timestamp() * 1000),
-                  "o": smart_round(r["open"]),  "h": smart_round(r["high"]),
-                  "l": smart_round(r["low"]),   "c": smart_round(r["close"]),
-                  "v": round(r["volume"], 2),
-                  "ma34": smart_round(r["ma34"]), "ma89": smart_round(r["ma89"]),
-                  "ma200": smart_round(r["ma200"]),
-                  "vol_ratio": round(r["vol_ratio"], 2)}
-                 for _, r in chart_df.iterrows()]
+    candles  = chart_candles(df_h1)
 
     _size = recommended_size(confidence, rr, direction,
                               funding=funding, atr_state=atr_ctx.get("atr_state"))
@@ -738,7 +729,7 @@ def swing_h1_analyze(symbol: str, cfg: dict) -> dict:
         "swing_high": smart_round(recent_h1_high),
         "swing_low":  smart_round(recent_h1_low),
         "candles":    candles,
-        "timestamp":  datetime.now(_TZ_VN).isoformat(),
+        "timestamp":  cfg.get("_scan_ts") or datetime.now(_TZ_VN).isoformat(),
         "h1_status":       m15_status,
         "h1_status_note":  m15_note,
         "entry_checklist": entry_checklist,
@@ -1,12 +1,16 @@
 """main.py — Entry point. Chạy: python main.py"""
-import json, os, threading, time
+import os, queue, tempfile, threading, time
+from collections import deque
 from datetime import datetime, timezone, timedelta
 from pathlib import Path
 
+import numpy as np
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from flask import Flask, jsonify, request, send_from_directory, make_response
 
-from core.utils import NumpyJSONProvider
+from core.utils import AnalyzeCache, NumpyJSONProvider, json_dumps, json_loads, njit
 from dashboard.fam_engine import fam_analyze
 from dashboard.swing_h1_engine import swing_h1_analyze
 from dashboard.scalp_engine import scalp_analyze
@@ -39,7 +43,8 @@ import os as _os
 _VOLUME_PATH = Path("/data") if Path("/data").exists() and _os.access("/data", _os.W_OK) else Path("data")
 DATA_DIR       = _VOLUME_PATH
 CONFIG_FILE    = DATA_DIR / "config.json"
-HISTORY_FILE   = DATA_DIR / "history.json"
+HISTORY_FILE   = DATA_DIR / "history.jsonl"   # append-only, 1 signal/dòng
+LEGACY_HISTORY_FILE = DATA_DIR / "history.json"  # format cũ (1 JSON array) — tự migrate
 POSITIONS_FILE = DATA_DIR / "positions.json"
 
 # ── Algorithm Version — tăng mỗi khi thay đổi filter/threshold ──
@@ -67,35 +72,82 @@ DEFAULT_CONFIG = {
     "auto_funding_watchlist": False,
 }
 
+# Cache config đã parse theo (st_mtime_ns, st_size) — tránh đọc + parse config.json mỗi
+# vòng scan/mỗi request. mtime_ns + size để không lỡ 2 lần ghi liên tiếp trong cùng
+# tick mtime thô. Lưu 1 tuple (key, data) để gán nguyên tử; hit không cần lock.
+_cfg_cache = (None, None)
+_cfg_miss_lock = threading.Lock()   # chỉ dùng khi miss — 1 thread parse, các thread khác chờ
+
+def _copy_cfg(obj):
+    """Copy dict/list lồng nhau của config — caller hay mutate cfg["symbols"]… nên
+    không được trả thẳng object trong cache (nhanh hơn copy.deepcopy ~2×)."""
+    if isinstance(obj, dict): return {k: _copy_cfg(v) for k, v in obj.items()}
+    if isinstance(obj, list): return [_copy_cfg(v) for v in obj]
+    return obj
+
+def _cfg_file_key():
+    try:
+        st = CONFIG_FILE.stat()
+        return (st.st_mtime_ns, st.st_size)
+    except OSError:
+        return None
+
 def load_config():
-    if CONFIG_FILE.exists():
+    global _cfg_cache
+    key = _cfg_file_key()
+    if key is None:
+        return _copy_cfg(DEFAULT_CONFIG)
+    cached_key, cached = _cfg_cache
+    if cached is not None and cached_key == key:
+        return _copy_cfg(cached)
+    with _cfg_miss_lock:
+        cached_key, cached = _cfg_cache
+        if cached is not None and cached_key == key:
+            return _copy_cfg(cached)
         try:
-            text = CONFIG_FILE.read_text().strip()
+            text = CONFIG_FILE.read_bytes().strip()
             if text:
-                cfg = json.loads(text)
+                cfg = json_loads(text)
                 # Merge với DEFAULT để không thiếu key mới
                 merged = DEFAULT_CONFIG.copy()
                 merged.update(cfg)
-                return merged
-        except (json.JSONDecodeError, Exception):
-            pass  # File corrupt → dùng default
-    return DEFAULT_CONFIG.copy()
+                _cfg_cache = (key, merged)
+                return _copy_cfg(merged)
+        except (OSError, ValueError, TypeError):
+            pass  # File sửa tay bị hỏng → dùng default
+    return _copy_cfg(DEFAULT_CONFIG)
+
+# Lock cho read-modify-write config (API POST + auto funding watchlist) — tránh 2 request
+# cùng load → update → save làm mất thay đổi của nhau. RLock vì có chỗ lồng nhau.
+_config_lock = threading.RLock()
 
 def save_config(cfg):
-    CONFIG_FILE.write_text(json.dumps(cfg, indent=2))
+    """Ghi config atomic: ghi file tạm cùng thư mục rồi os.replace — crash giữa chừng
+    không để lại config.json ghi dở."""
+    global _cfg_cache
+    with tempfile.NamedTemporaryFile("w", dir=DATA_DIR, suffix=".tmp",
+                                     delete=False, encoding="utf-8") as f:
+        f.write(json_dumps(cfg, indent=True))
+        tmp_path = f.name
+    os.replace(tmp_path, CONFIG_FILE)
+    _analyze_cache.clear()   # kết quả engine phụ thuộc cfg (rr_ratio, strategy…)
+    merged = DEFAULT_CONFIG.copy()
+    merged.update(cfg)
+    key = _cfg_file_key()
+    _cfg_cache = (key, _copy_cfg(merged)) if key is not None else (None, None)
 
 def load_positions():
     """Load danh sách position đã phân tích từ file."""
     if POSITIONS_FILE.exists():
         try:
-            return json.loads(POSITIONS_FILE.read_text())
+            return json_loads(POSITIONS_FILE.read_bytes())
         except Exception:
             return []
     return []
 
 def save_positions(positions: list):
     """Lưu tối đa 50 positions gần nhất."""
-    POSITIONS_FILE.write_text(json.dumps(positions[:50], indent=2))
+    POSITIONS_FILE.write_text(json_dumps(positions[:50], indent=True), encoding="utf-8")
 
 def _clean_for_json(obj):
     """Recursively replace NaN/Infinity with None — json chuẩn không hỗ trợ."""
@@ -110,27 +162,130 @@ def _clean_for_json(obj):
         return [_clean_for_json(v) for v in obj]
     return obj
 
+HISTORY_MAX           = 500   # giữ 500 records (tăng từ 200)
+HISTORY_COMPACT_EVERY = 50    # sau N lần append → rewrite file, cắt về HISTORY_MAX
+_history_appends      = 0
+# History giữ trong RAM (deque maxlen) — đọc không cần parse file; file jsonl chỉ để persist.
+# Nạp lười lần đầu load_history(). Mọi ghi (append/rewrite) đi qua _history_save_lock
+# (RLock: _save_signal_to_history giữ lock rồi gọi load_history).
+_history_mem       = None
+_history_save_lock = threading.RLock()
+
+def _history_line(entry) -> str:
+    return json_dumps(_clean_for_json(entry), default=str) + "\n"
+
+def _migrate_legacy_history():
+    """history.json (JSON array, rewrite toàn bộ mỗi signal) → history.jsonl.
+    File cũ đổi tên thành .bak, không xoá."""
+    if HISTORY_FILE.exists() or not LEGACY_HISTORY_FILE.exists():
+        return
+    try:
+        legacy = json_loads(LEGACY_HISTORY_FILE.read_bytes() or b"[]")
+        save_history(legacy if isinstance(legacy, list) else [])
+        LEGACY_HISTORY_FILE.rename(LEGACY_HISTORY_FILE.with_suffix(".json.bak"))
+        print(f"[STORAGE] Migrated {len(legacy)} history records → {HISTORY_FILE.name}")
+    except Exception as e:
+        print(f"[STORAGE] Migrate history lỗi: {e}")
+
+def _read_history_file() -> list:
+    if not HISTORY_FILE.exists():
+        return []
+    history = []
+    try:
+        with HISTORY_FILE.open("r", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    history.append(json_loads(line))
+                except ValueError:
+                    continue  # dòng ghi dở (crash giữa chừng) → bỏ qua
+    except Exception:
+        return []
+    return history[-HISTORY_MAX:]
+
+def _history_records():
+    """Deque history trong RAM — nạp từ file (kèm migrate format cũ) ở lần gọi đầu."""
+    global _history_mem
+    if _history_mem is None:
+        with _history_save_lock:
+            if _history_mem is None:
+                _migrate_legacy_history()
+                if _history_mem is None:
+                    _history_mem = deque(_read_history_file(), maxlen=HISTORY_MAX)
+    return _history_mem
+
 def load_history():
-    if HISTORY_FILE.exists():
-        try:
-            return json.loads(HISTORY_FILE.read_text())
-        except Exception:
-            return []
-    return []
+    with _history_save_lock:
+        return list(_history_records())
+
+def _write_history_lines(lines: list):
+    global _history_appends
+    tmp = HISTORY_FILE.with_suffix(".jsonl.tmp")
+    with tmp.open("w", encoding="utf-8") as f:
+        f.writelines(lines)
+    os.replace(tmp, HISTORY_FILE)
+    _history_appends = 0
 
 def save_history(h):
-    cleaned = _clean_for_json(h[-500:])  # giữ 500 records (tăng từ 200)
-    HISTORY_FILE.write_text(json.dumps(cleaned, indent=2, allow_nan=False, default=str))
+    """Rewrite toàn bộ history (import / clear / migrate) — ghi file tạm rồi replace.
+    RAM nạp lại từ chính các dòng đã ghi để khớp 100% với file (NaN → null…)."""
+    global _history_mem
+    with _history_save_lock:
+        lines = [_history_line(entry) for entry in h[-HISTORY_MAX:]]
+        _write_history_lines(lines)
+        _history_mem = deque((json_loads(l) for l in lines), maxlen=HISTORY_MAX)
+
+def _append_history(entry: dict):
+    """Ghi thêm 1 signal — O(1): append 1 dòng vào file + push vào deque.
+    Mỗi HISTORY_COMPACT_EVERY lần append thì rewrite file từ RAM để file không phình."""
+    global _history_appends
+    with _history_save_lock:
+        records = _history_records()
+        line = _history_line(entry)
+        with HISTORY_FILE.open("a", encoding="utf-8") as f:
+            f.write(line)
+        records.append(json_loads(line))
+        _history_appends += 1
+        if _history_appends >= HISTORY_COMPACT_EVERY:
+            _write_history_lines([_history_line(e) for e in records])
 
 # ── Background auto-scanner (Dashboard) ───────
 scan_results = {}
 scan_lock    = threading.Lock()
+# Copy-on-write: scan_results + _results_snapshot không bao giờ bị mutate tại chỗ —
+# writer dựng dict mới rồi rebind (1 STORE_GLOBAL, atomic trong CPython).
+# Reader (/api/results poll liên tục) đọc reference không cần lock; scan_lock chỉ
+# serialize các writer với nhau (scanner thread vs /api/scan) để không mất update.
+_results_snapshot = ()
+
+def _set_scan_result(sym: str, result: dict):
+    global scan_results, _results_snapshot
+    with scan_lock:
+        new = {**scan_results, sym: result}
+        scan_results      = new
+        _results_snapshot = tuple(new.values())
 scanner_running = False
+# Event dừng scanner — loop chờ bằng stop.wait(timeout) thay vì poll sleep(5):
+# stop có hiệu lực ngay, mỗi interval chỉ thức dậy 1 lần. Mỗi lần start tạo Event MỚI
+# và truyền cho các thread → stop/start liên tiếp không "hồi sinh" thread cũ.
+_stop_evt = threading.Event()
+_stop_evt.set()
+_scanner_start_lock = threading.Lock()
 scanner_status  = {"is_scanning": False, "last_scan": None,
                    "next_scan": None, "scan_count": 0}
 
 _loss_cooldown_cache = {}  # (sym, dir) -> (checked_at_ts, loss_count)
 
+def _history_ts(h: dict) -> float:
+    """Unix timestamp của 1 history record — dùng ts_unix lưu sẵn (record mới),
+    fallback parse ISO "time" cho record cũ/import. Raise nếu không parse được."""
+    ts = h.get("ts_unix")
+    if ts is not None:
+        return float(ts)
+    return datetime.fromisoformat(h.get("time", "")).timestamp()
+
 def _count_recent_losses(symbol: str, direction: str, hours: int = 12) -> int:
     """
     Đếm số LOSS gần đây cho (symbol, direction) bằng cách:
@@ -158,7 +313,7 @@ def _count_recent_losses(symbol: str, direction: str, hours: int = 12) -> int:
         if h.get("symbol") != symbol or h.get("direction") != direction:
             continue
         try:
-            ts = datetime.fromisoformat(h.get("time", "")).timestamp()
+            ts = _history_ts(h)
         except Exception:
             continue
         if ts < cutoff:
@@ -178,8 +333,9 @@ def _count_recent_losses(symbol: str, direction: str, hours: int = 12) -> int:
         if df is None or len(df) == 0:
             _loss_cooldown_cache[key] = (now, 0)
             return 0
-        df = df.copy()
-        df["ts"] = df.index.astype("int64") // 10**9
+        ts   = df.index.as_unit("ns").asi8 // 10**9
+        lows  = df["low"].to_numpy(dtype=np.float64)
+        highs = df["high"].to_numpy(dtype=np.float64)
     except Exception:
         _loss_cooldown_cache[key] = (now, 0)
         return 0
@@ -192,15 +348,15 @@ def _count_recent_losses(symbol: str, direction: str, hours: int = 12) -> int:
             continue
         if sl <= 0:
             continue
-        df_after = df[df["ts"] >= sig_ts - 60]
-        if df_after.empty:
+        cut = int(np.searchsorted(ts, sig_ts - 60, side="left"))
+        if cut >= len(ts):
             continue
         try:
             if direction == "LONG":
-                if float(df_after["low"].min()) <= sl:
+                if float(np.nanmin(lows[cut:])) <= sl:
                     loss_count += 1
             else:
-                if float(df_after["high"].max()) >= sl:
+                if float(np.nanmax(highs[cut:])) >= sl:
                     loss_count += 1
         except Exception:
             continue
@@ -276,11 +432,12 @@ def _is_duplicate_signal(result: dict, history: list, window_hours: int = 2) ->
 
     for h in history[-100:]:
         try:
-            ts = datetime.fromisoformat(h.get("time", "")).timestamp()
-            if ts < cutoff:
-                continue
+            # So symbol/direction trước — rẻ hơn parse timestamp cho mọi row
             if h.get("symbol") != sym or h.get("direction") != dirr:
                 continue
+            ts = _history_ts(h)
+            if ts < cutoff:
+                continue
             h_strat = (h.get("strategy") or h.get("algo") or "").upper()
             # Tầng 1: REVERSAL cooldown 60 phút — chỉ áp khi cả 2 đều REVERSAL
             if is_rev and h_strat == "REVERSAL" and ts >= rev_cutoff:
@@ -305,8 +462,6 @@ def _fetch_vol_safe(symbol: str) -> float:
         return 0.0
 
 
-_history_save_lock = threading.Lock()
-
 def _save_signal_to_history(result: dict):
     """Lưu signal vào history — dedup chặt theo symbol+direction+entry±1% trong 2 giờ.
     Bypass dedup cho watchlist/position-reversal save (cooldown đã handled ở caller).
@@ -322,8 +477,14 @@ def _save_signal_to_history(result: dict):
         if not bypass and _is_duplicate_signal(result, history, window_hours=2):
             print(f"[DEDUP] Skip {result.get('symbol')} {result.get('direction')} — duplicate trong 2h")
             return
-        history.append({
-            "time":            result.get("timestamp", _local_isoformat()),
+        sig_time = result.get("timestamp") or _local_isoformat()
+        try:
+            ts_unix = datetime.fromisoformat(sig_time).timestamp()
+        except (TypeError, ValueError):
+            ts_unix = time.time()
+        _append_history({
+            "time":            sig_time,
+            "ts_unix":         round(ts_unix, 3),
             "symbol":          result.get("symbol", ""),
             "direction":       result.get("direction", ""),
             "confidence":      result.get("confidence", ""),
@@ -374,11 +535,10 @@ def _save_signal_to_history(result: dict):
             "algo_version":    ALGO_VERSION,
             "algo_date":       ALGO_DATE,
         })
-        save_history(history)
 
 
-def _send_high_alert(result: dict, token: str, chat_id: str):
-    """Gửi Telegram alert cho tín hiệu HIGH — plain text, không Markdown."""
+def _format_high_alert(result: dict) -> str:
+    """Format nội dung Telegram alert cho tín hiệu HIGH — plain text, không Markdown."""
     verdict   = result.get("entry_verdict", "WAIT")
     sym       = result.get("symbol", "?")
     dirr      = result.get("direction", "?")
@@ -476,9 +636,39 @@ def _send_high_alert(result: dict, token: str, chat_id: str):
         lines.append("Canh bao:")
         for w in warns[:3]:
             lines.append("  " + str(w))
-    msg = chr(10).join(lines)
-    send_telegram(token, chat_id, msg)
+    return chr(10).join(lines)
+
+
+TELEGRAM_MSG_LIMIT = 4000   # Telegram giới hạn 4096 ký tự/tin — chừa margin
+_ALERT_SEPARATOR   = "\n\n========\n\n"
 
+def _chunk_alert_messages(msgs: list, limit: int = TELEGRAM_MSG_LIMIT) -> list:
+    """Gộp nhiều alert thành ít tin nhắn nhất có thể, mỗi tin ≤ limit ký tự.
+    Alert đơn lẻ dài hơn limit vẫn được gửi riêng (không cắt giữa chừng)."""
+    chunks, cur = [], ""
+    for m in msgs:
+        if not m:
+            continue
+        if cur and len(cur) + len(_ALERT_SEPARATOR) + len(m) > limit:
+            chunks.append(cur)
+            cur = m
+        else:
+            cur = cur + _ALERT_SEPARATOR + m if cur else m
+    if cur:
+        chunks.append(cur)
+    return chunks
+
+
+
+# Cache kết quả engine theo phút — dashboard poll /api/symbol, /api/scan liên tục và
+# watchlist loop phân tích cùng symbol; nến H1/H4 không đổi trong 1 phút nên kết quả
+# y hệt. Key (engine, symbol, force_futures, phút); save_config xoá cache vì cfg đổi.
+ANALYZE_CACHE_TTL = 55   # giây
+_analyze_cache = AnalyzeCache(ANALYZE_CACHE_TTL)
+
+def _cached_analyze(engine_fn, sym: str, cfg: dict) -> dict:
+    """Gọi engine_fn(sym, cfg) qua cache TTL dùng chung của dashboard (xem AnalyzeCache)."""
+    return _analyze_cache(engine_fn, sym, cfg)
 
 
 def get_analyze_fn(cfg):
@@ -489,8 +679,20 @@ def get_analyze_fn(cfg):
     return fam_analyze  # mặc định SWING_H4
 
 
-def _check_watchlist_alert(sym: str, result: dict, cfg: dict, algo_key: str):
-    """Alert Telegram khi mã watchlist đang đúng điểm entry hoặc gần entry tốt."""
+def _watchlist_algo_labels(cfg: dict) -> dict:
+    return {
+        "TREND": "Trend " + cfg.get("strategy", "SWING_H4"),
+        "RANGE_SCALP": "Range Scalp",
+        "SWING_H4": "Swing H4/D1",
+        "SWING_H1": "Swing H1",
+        "SCALP": "Scalp M15",
+    }
+
+
+def _check_watchlist_alert(sym: str, result: dict, cfg: dict, algo_key: str,
+                           algo_labels: dict = None):
+    """Alert Telegram khi mã watchlist đang đúng điểm entry hoặc gần entry tốt.
+    algo_labels: nhãn algo dựng sẵn 1 lần/cycle (None → tự dựng từ cfg)."""
     token   = cfg.get("telegram_token", "")
     chat_id = cfg.get("telegram_chat", "")
     if not token or not chat_id:
@@ -579,13 +781,7 @@ def _check_watchlist_alert(sym: str, result: dict, cfg: dict, algo_key: str):
     except Exception as e:
         print(f"[WATCHLIST SAVE ERROR] {sym}: {e}")
 
-    strat_labels = {
-        "TREND": "Trend " + cfg.get("strategy", "SWING_H4"),
-        "RANGE_SCALP": "Range Scalp",
-        "SWING_H4": "Swing H4/D1",
-        "SWING_H1": "Swing H1",
-        "SCALP": "Scalp M15",
-    }
+    strat_labels = algo_labels or _watchlist_algo_labels(cfg)
     algo_label = strat_labels.get(algo_key, algo_key)
     dir_emoji  = "🟢" if direction == "LONG" else "🔴"
     mk         = result.get("market", {})
@@ -637,7 +833,7 @@ def _check_watchlist_alert(sym: str, result: dict, cfg: dict, algo_key: str):
         f"Funding: {mk.get('funding_pct','N/A')} | OI: {mk.get('oi_str','N/A')}",
     ]
 
-    send_telegram(token, chat_id, chr(10).join(lines))
+    queue_telegram(token, chat_id, chr(10).join(lines))
 
 
 _watchlist_alert_cooldown = {}
@@ -699,19 +895,23 @@ def _auto_add_funding_spike_watchlist(cfg, min_volume: float = 20_000_000,
     candidates.sort(key=lambda x: -abs(x[1]))
     picked = candidates[:max_add]
 
-    if "watchlist_algos" not in cfg:
-        cfg["watchlist_algos"] = {}
-
     added = []
-    for sym, f, vol in picked:
-        cfg["symbols"].append(sym)
-        cfg["watchlist_algos"][sym] = "RANGE_SCALP"
-        added.append(sym)
-        direction_hint = "SHORT" if f > 0 else "LONG"
-        print(f"[FUNDING SPIKE] +{sym} funding {f:+.4f}% vol {vol/1e6:.1f}M → watchlist (hint: {direction_hint})")
-
-    if added:
-        save_config(cfg)
+    with _config_lock:
+        # Reload dưới lock — cfg truyền vào có thể đã cũ sau thời gian fetch ở trên
+        cfg = load_config()
+        if "watchlist_algos" not in cfg:
+            cfg["watchlist_algos"] = {}
+        for sym, f, vol in picked:
+            if sym in cfg["symbols"]:
+                continue
+            cfg["symbols"].append(sym)
+            cfg["watchlist_algos"][sym] = "RANGE_SCALP"
+            added.append(sym)
+            direction_hint = "SHORT" if f > 0 else "LONG"
+            print(f"[FUNDING SPIKE] +{sym} funding {f:+.4f}% vol {vol/1e6:.1f}M → watchlist (hint: {direction_hint})")
+
+        if added:
+            save_config(cfg)
     return added
 
 
@@ -723,8 +923,9 @@ def dashboard_scan_cycle(cfg):
     from dashboard.range_engine     import range_analyze
     from dashboard.reversal_engine  import reversal_analyze
 
+    default_fn = get_analyze_fn(cfg)
     algo_map = {
-        "TREND":       get_analyze_fn(cfg),
+        "TREND":       default_fn,
         "RANGE_SCALP": range_analyze,
         "REVERSAL":    reversal_analyze,
         "SWING_H4":    fam_analyze,
@@ -732,22 +933,25 @@ def dashboard_scan_cycle(cfg):
         "SCALP":       scalp_analyze,
     }
     watchlist_algos = cfg.get("watchlist_algos", {})
+    # Bất biến trong 1 cycle — dựng 1 lần thay vì mỗi symbol (engine chỉ đọc cfg)
+    engine_cfg  = {**cfg, "force_futures": True}
+    alerts_on   = bool(cfg.get("telegram_token", "") and cfg.get("telegram_chat", ""))
+    algo_labels = _watchlist_algo_labels(cfg)
 
     for sym in cfg["symbols"]:
         try:
             algo_key  = watchlist_algos.get(sym, "TREND")
-            engine_fn = algo_map.get(algo_key, get_analyze_fn(cfg))
-            result    = engine_fn(sym, {**cfg, "force_futures": True})
+            engine_fn = algo_map.get(algo_key, default_fn)
+            result    = _cached_analyze(engine_fn, sym, engine_cfg)
             result["algo"] = algo_key
-            with scan_lock:
-                scan_results[sym] = result
+            _set_scan_result(sym, result)
 
             # Watchlist alert: chỉ alert khi đúng điểm entry
-            _check_watchlist_alert(sym, result, cfg, algo_key)
+            if alerts_on:
+                _check_watchlist_alert(sym, result, cfg, algo_key, algo_labels)
 
         except Exception as e:
-            with scan_lock:
-                scan_results[sym] = {"symbol": sym, "error": str(e)}
+            _set_scan_result(sym, {"symbol": sym, "error": str(e)})
 
 
 def market_scan_cycle(cfg):
@@ -806,16 +1010,22 @@ def market_scan_cycle(cfg):
 
     print(f"[MARKET SCAN] Xong — {len(results)} signals, {len(high_signals)} HIGH")
 
+    alert_msgs = []
     for result in high_signals:
         # Lưu history
         _save_signal_to_history(result)
-        # Gửi Telegram
         if token and chat_id:
             try:
-                _send_high_alert(result, token, chat_id)
+                alert_msgs.append(_format_high_alert(result))
             except Exception as e:
                 print(f"[TELEGRAM ERROR] {result.get('symbol')}: {e}")
 
+    # Gửi Telegram theo batch — 1 request/chunk thay vì 1 request/signal
+    # (tránh rate limit 1 msg/s/chat khi nhiều HIGH cùng lúc)
+    if token and chat_id and alert_msgs:
+        for chunk in _chunk_alert_messages(alert_msgs):
+            queue_telegram(token, chat_id, chunk)
+
 # ── Position Monitor — alert reversal cho lệnh đang mở ──
 _position_alert_cooldown = {}
 
@@ -901,8 +1111,8 @@ def _check_position_reversal(pos: dict, cfg: dict):
     else:
         lines.append(f"⚠️ Can nhac CLOSE SHORT + flip LONG")
 
-    send_telegram(token, chat_id, chr(10).join(lines))
-    print(f"[POS ALERT] {sym} {pos_dir} → reversal {rev_dir} alert sent")
+    queue_telegram(token, chat_id, chr(10).join(lines))
+    print(f"[POS ALERT] {sym} {pos_dir} → reversal {rev_dir} alert queued")
 
     # Save vào history với tag source — track lại các reversal alert cho lệnh đang mở
     try:
@@ -983,7 +1193,7 @@ def _check_position_sl_tp(pos: dict, cfg: dict) -> str:
                 "─────────────────",
                 f"Đã tự xóa khỏi monitor (id: {pos.get('id')})",
             ]
-            send_telegram(token, chat_id, chr(10).join(lines))
+            queue_telegram(token, chat_id, chr(10).join(lines))
         except Exception as e:
             print(f"[POS SL/TP ALERT] {sym} error: {e}")
 
@@ -991,13 +1201,13 @@ def _check_position_sl_tp(pos: dict, cfg: dict) -> str:
     return hit
 
 
-def position_monitor_loop():
+def position_monitor_loop(stop=None):
     """Monitor positions đang mở:
     1. Check nếu chạm SL/TP → tự xóa khỏi monitor + Telegram alert
     2. Check reversal signal → Telegram alert (vẫn giữ position)
     """
-    global scanner_running
-    while scanner_running:
+    stop = stop or _stop_evt
+    while not stop.is_set():
         try:
             cfg = load_config()
             interval = int(cfg.get("position_monitor_interval_sec", 120))
@@ -1031,18 +1241,16 @@ def position_monitor_loop():
                 except Exception as e:
                     print(f"[POS LOOP] {pos.get('symbol')} error: {e}")
 
-            elapsed = 0
-            while elapsed < interval and scanner_running:
-                time.sleep(5); elapsed += 5
+            stop.wait(interval)
         except Exception as e:
             print(f"[POS MONITOR LOOP] {e} — retry sau 60s")
-            time.sleep(60)
+            stop.wait(60)
 
 
-def watchlist_fast_loop():
+def watchlist_fast_loop(stop=None):
     """Loop riêng cho watchlist — quét nhanh hơn (1-2 phút) để alert tức thì."""
-    global scanner_running
-    while scanner_running:
+    stop = stop or _stop_evt
+    while not stop.is_set():
         try:
             cfg = load_config()
             wl_interval = int(cfg.get("watchlist_interval_sec", 90))  # mặc định 90s
@@ -1052,18 +1260,17 @@ def watchlist_fast_loop():
             except Exception as e:
                 print(f"[WATCHLIST FAST LOOP ERROR] {e}")
 
-            elapsed = 0
-            while elapsed < wl_interval and scanner_running:
-                time.sleep(5); elapsed += 5
+            stop.wait(wl_interval)
         except Exception as e:
             print(f"[WATCHLIST LOOP ERROR] {e} — retry sau 30s")
-            time.sleep(30)
+            stop.wait(30)
 
 
-def dashboard_scanner_loop():
+def dashboard_scanner_loop(stop=None):
     """Market-wide scan — chậm hơn (15+ phút) vì quét toàn thị trường."""
-    global scanner_running, scanner_status
-    while scanner_running:
+    global scanner_status
+    stop = stop or _stop_evt
+    while not stop.is_set():
         try:
             cfg = load_config()
             interval_sec = cfg.get("interval_minutes", 30) * 60
@@ -1088,21 +1295,20 @@ def dashboard_scanner_loop():
             except Exception as e:
                 print(f"[MARKET SCAN ERROR] {e}")
 
-            scan_duration = round(time.time() - scan_start_ts)
+            # Lấy thời điểm kết thúc 1 lần — dùng chung cho duration/last/next
+            scan_end_ts = time.time()
             scanner_status["is_scanning"]  = False
             scanner_status["scan_count"]  += 1
             scanner_status["last_scan"]    = _local_isoformat()
-            scanner_status["scan_duration"] = scan_duration
+            scanner_status["scan_duration"] = round(scan_end_ts - scan_start_ts)
             scanner_status["next_scan"]     = datetime.fromtimestamp(
-                time.time() + interval_sec).isoformat()
+                scan_end_ts + interval_sec).isoformat()
 
-            elapsed = 0
-            while elapsed < interval_sec and scanner_running:
-                time.sleep(5); elapsed += 5
+            stop.wait(interval_sec)
         except Exception as e:
             print(f"[SCANNER LOOP ERROR] {e} — tiếp tục sau 60s")
             scanner_status["is_scanning"] = False
-            time.sleep(60)
+            stop.wait(60)
 
 # ── API — Frontend (static) ───────────────────
 @app.route("/")
@@ -1121,7 +1327,7 @@ def api_paper_trades():
     if not _os.path.exists(pf):
         return jsonify({"open": [], "closed": [], "stats": None})
     try:
-        p = json.loads(open(pf).read())
+        p = json_loads(open(pf, "rb").read())
     except Exception:
         return jsonify({"open": [], "closed": [], "stats": None})
     closed = p.get("closed", [])
@@ -1214,7 +1420,8 @@ fetch('/api/paper/trades').then(r=>r.json()).then(d=>{
 @app.route("/api/config", methods=["GET", "POST"])
 def config_api():
     if request.method == "POST":
-        cfg = load_config(); cfg.update(request.json); save_config(cfg)
+        with _config_lock:
+            cfg = load_config(); cfg.update(request.json); save_config(cfg)
         return jsonify({"ok": True})
     return jsonify(load_config())
 
@@ -1226,13 +1433,12 @@ def scan_now():
     # CHỐNG 418: đang bị ban → KHÔNG poke Binance (tránh burst re-ban khi vừa hết
     # ban). Trả kết quả CACHE (list như cũ, front-end render bình thường).
     if ban_remaining() > 0:
-        with scan_lock:
-            return jsonify(list(scan_results.values()))
+        return jsonify(list(_results_snapshot))
     out = []
     for sym in cfg["symbols"]:
         try:
-            r = get_analyze_fn(cfg)(sym, cfg)
-            with scan_lock: scan_results[sym] = r
+            r = _cached_analyze(get_analyze_fn(cfg), sym, cfg)
+            _set_scan_result(sym, r)
             out.append(r)
         except Exception as e:
             out.append({"symbol": sym, "error": str(e)})
@@ -1262,16 +1468,16 @@ def symbol_detail(symbol):
                 "TREND":       get_analyze_fn(cfg),
             }
             engine = engine_map.get(algo_override, get_analyze_fn(cfg))
-            result = engine(symbol, {**cfg, "force_futures": True})
+            result = _cached_analyze(engine, symbol, {**cfg, "force_futures": True})
             result["algo"] = algo_override
             return jsonify(result)
-        return jsonify(get_analyze_fn(cfg)(symbol, cfg))
+        return jsonify(_cached_analyze(get_analyze_fn(cfg), symbol, cfg))
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 @app.route("/api/results")
 def get_results():
-    with scan_lock: return jsonify(list(scan_results.values()))
+    return jsonify(list(_results_snapshot))
 
 @app.route("/api/history")
 def get_history():
@@ -1333,31 +1539,115 @@ def history_import():
     signals = (request.json or {}).get("signals", [])
     if not signals:
         return jsonify({"ok": False, "error": "Không có signals"})
-    history = load_history()
-    existing_keys = set()
-    for h in history:
-        key = f"{h.get('symbol','')}|{h.get('direction','')}|{h.get('time','')}"
-        existing_keys.add(key)
-    added = 0
-    for sig in signals:
-        if not sig.get("symbol"):
-            continue
-        key = f"{sig.get('symbol','')}|{sig.get('direction','')}|{sig.get('time','')}"
-        if key not in existing_keys:
-            history.append(sig)
+    with _history_save_lock:
+        history = load_history()
+        existing_keys = set()
+        for h in history:
+            key = f"{h.get('symbol','')}|{h.get('direction','')}|{h.get('time','')}"
             existing_keys.add(key)
-            added += 1
-    save_history(history)
+        added = 0
+        for sig in signals:
+            if not sig.get("symbol"):
+                continue
+            key = f"{sig.get('symbol','')}|{sig.get('direction','')}|{sig.get('time','')}"
+            if key not in existing_keys:
+                history.append(sig)
+                existing_keys.add(key)
+                added += 1
+        save_history(history)
     return jsonify({"ok": True, "added": added, "total": len(load_history())})
 
 @app.route("/api/history/clear", methods=["POST"])
 def clear_history():
-    save_history([])
+    with _history_save_lock:
+        save_history([])
     return jsonify({"ok": True})
 
 
 # ── Backtest ──────────────────────────────────
-def backtest_signal(signal: dict, bt_mode: str = "MARKET") -> dict:
+@njit(cache=True, nogil=True)
+def _first_hit(highs, lows, sl, tp1, is_long, start):
+    """Tìm nến đầu tiên (từ index start) chạm TP1 hoặc SL — vectorize bằng mask + argmax.
+    Returns (kind, idx): kind 0=WIN, 1=LOSS, 2=OPEN (idx=-1).
+    Cùng nến chạm cả 2 → giả định TP trước (conservative, giữ như logic cũ)."""
+    h = highs[start:]
+    l = lows[start:]
+    if is_long:
+        sl_hits = l <= sl
+        tp_hits = h >= tp1
+    else:
+        sl_hits = h >= sl
+        tp_hits = l <= tp1
+    i_sl = np.argmax(sl_hits) if sl_hits.any() else -1
+    i_tp = np.argmax(tp_hits) if tp_hits.any() else -1
+    if i_tp >= 0 and (i_sl < 0 or i_tp <= i_sl):
+        return 0, int(start + i_tp)
+    if i_sl >= 0:
+        return 1, int(start + i_sl)
+    return 2, -1
+
+
+def _bt_signal_ts(sig_time) -> float:
+    """Signal time (ISO; thiếu timezone → coi là giờ VN) → unix timestamp UTC. Raise nếu sai format."""
+    import pandas as pd
+    ts_parsed = pd.Timestamp(sig_time)
+    if ts_parsed.tzinfo is None:
+        ts_parsed = ts_parsed.tz_localize("Asia/Ho_Chi_Minh")
+    return ts_parsed.tz_convert("UTC").timestamp()
+
+
+def _bt_timeframe(strategy: str) -> tuple:
+    """Timeframe backtest theo strategy → (interval, label, phút/nến).
+    Tất cả strategy đều dùng M15 hoặc nhỏ hơn để wick detection chính xác.
+    H1 timeframe có thể MISS wick: nếu giá dip nhanh xuống SL trong vài phút
+    rồi bounce, H1 low ghi nhận được nhưng nếu data H1 chưa close (live candle)
+    thì có thể chưa cập nhật full wick → SL hit không được detect đúng.
+    Scalp: M5 / Swing H1: M15 / Swing H4: M15 (thay vì H1 cũ — chính xác 4x hơn)"""
+    if strategy == "SCALP":
+        return "5m", "M5", 5
+    return "15m", "M15", 15
+
+
+def _bt_kline_limit(hours_since: float, minutes_per_candle: int) -> int:
+    """Số nến cần fetch để phủ từ lúc signal tới hiện tại (+20 nến đệm, max 500)."""
+    candles_needed = max(50, int(hours_since * 60 / minutes_per_candle) + 20)
+    return min(candles_needed, 500)
+
+
+def prefetch_bt_klines(signals: list, max_workers: int = 8) -> dict:
+    """Fetch klines 1 lần cho mỗi (symbol, interval) thay vì 1 lần/signal/mode.
+    limit = max số nến mà các signal cùng coin cần — df dài hơn không đổi kết quả
+    (backtest chỉ xét nến sau signal time). Trả về {(symbol, interval): df};
+    coin fetch lỗi bị bỏ qua → backtest_signal tự fetch và báo lỗi như cũ."""
+    import concurrent.futures
+    from core.binance import fetch_klines
+    now_ts = datetime.now(timezone.utc).timestamp()
+    need = {}
+    for sig in signals:
+        try:
+            if sig.get("direction") == "WAIT":
+                continue
+            interval, _, mpc = _bt_timeframe(sig.get("strategy", "SWING_H4"))
+            limit = _bt_kline_limit((now_ts - _bt_signal_ts(sig["time"])) / 3600, mpc)
+        except Exception:
+            continue
+        key = (sig["symbol"], interval)
+        need[key] = max(need.get(key, 0), limit)
+
+    def _fetch(item):
+        (sym, interval), limit = item
+        try:
+            return (sym, interval), fetch_klines(sym, interval, limit, force_futures=True)
+        except Exception:
+            return (sym, interval), None
+
+    if not need:
+        return {}
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as ex:
+        return {k: df for k, df in ex.map(_fetch, need.items()) if df is not None}
+
+
+def backtest_signal(signal: dict, bt_mode: str = "MARKET", klines: dict = None) -> dict:
     """
     Backtest signal: dùng M5 cho scalp, M15 cho swing H1, H1 cho swing H4.
 
@@ -1369,8 +1659,11 @@ def backtest_signal(signal: dict, bt_mode: str = "MARKET") -> dict:
       - "LIMIT_SAFE_SL": entry = entry_opt, SL = sl_opt (nới ra để giữ
         sl_pct ≥ max(2%, 1.5×ATR) — verify giả thuyết rằng entry_opt có thể work
         nếu SL đủ wide để tránh noise quét.
+
+    klines: dict từ prefetch_bt_klines — có sẵn (symbol, interval) thì dùng, khỏi fetch.
     """
     from core.binance import fetch_klines, fetch_volume_24h
+    import numpy as np
     import pandas as pd
 
     symbol    = signal["symbol"]
@@ -1431,10 +1724,7 @@ def backtest_signal(signal: dict, bt_mode: str = "MARKET") -> dict:
                 pass
 
     try:
-        ts_parsed = pd.Timestamp(sig_time)
-        if ts_parsed.tzinfo is None:
-            ts_parsed = ts_parsed.tz_localize("Asia/Ho_Chi_Minh")
-        sig_ts = ts_parsed.tz_convert("UTC").timestamp()
+        sig_ts = _bt_signal_ts(sig_time)
     except Exception:
         return {**signal, "bt_result": "ERROR", "bt_note": "Invalid timestamp",
                 "bt_candles": None, "bt_pnl_r": None, "bt_exit_price": None}
@@ -1445,46 +1735,29 @@ def backtest_signal(signal: dict, bt_mode: str = "MARKET") -> dict:
         hours_since = (now_ts - sig_ts) / 3600
 
         # ── Chọn timeframe backtest theo strategy ──
-        # Tất cả strategy đều dùng M15 hoặc nhỏ hơn để wick detection chính xác.
-        # H1 timeframe có thể MISS wick: nếu giá dip nhanh xuống SL trong vài phút
-        # rồi bounce, H1 low ghi nhận được nhưng nếu data H1 chưa close (live candle)
-        # thì có thể chưa cập nhật full wick → SL hit không được detect đúng.
-        # Scalp: M5 / Swing H1: M15 / Swing H4: M15 (thay vì H1 cũ — chính xác 4x hơn)
         strategy = signal.get("strategy", "SWING_H4")
-        if strategy == "SCALP":
-            bt_interval, bt_label = "5m", "M5"
-            minutes_per_candle = 5
-        elif strategy == "SWING_H1":
-            bt_interval, bt_label = "15m", "M15"
-            minutes_per_candle = 15
-        else:
-            bt_interval, bt_label = "15m", "M15"
-            minutes_per_candle = 15
+        bt_interval, bt_label, minutes_per_candle = _bt_timeframe(strategy)
 
-        # Tính số nến cần fetch
-        candles_needed = max(50, int(hours_since * 60 / minutes_per_candle) + 20)
-        limit = min(candles_needed, 500)
-
-        df = fetch_klines(symbol, bt_interval, limit, force_futures=True)
-        df = df.copy()
-        # Robust timestamp conversion — dùng .timestamp() method thay vì astype int64
-        # (tránh bug pandas version / tz handling khác nhau giữa các môi trường)
-        try:
-            df["ts"] = df.index.map(lambda x: int(x.timestamp())).astype("int64")
-        except Exception:
-            # Fallback nếu .timestamp() fail (e.g. tz-aware index)
-            df["ts"] = (df.index.astype("int64") // 10**9).astype("int64")
+        df = (klines or {}).get((symbol, bt_interval))
+        if df is None:
+            df = fetch_klines(symbol, bt_interval, _bt_kline_limit(hours_since, minutes_per_candle),
+                              force_futures=True)
+        # Unix giây của từng nến. as_unit("ns") trước khi lấy asi8 — pandas mới có thể
+        # suy ra index đơn vị ms/s; asi8 luôn là UTC kể cả index tz-aware.
+        # Không copy df, không thêm cột: df có thể là bản prefetch dùng chung.
+        ts = df.index.as_unit("ns").asi8 // 10**9
 
         # Validate: nếu last candle quá cũ vs signal time → fetch có thể bị stale/fail
         if len(df) > 0:
-            last_candle_ts = int(df["ts"].iloc[-1])
+            last_candle_ts = int(ts[-1])
             if last_candle_ts <= 0 or (sig_ts - last_candle_ts) > 86400 * 7:
                 # Last candle invalid hoặc cách signal > 7 ngày → fetch fail rồi
                 return {**signal, "bt_result": "ERROR",
                         "bt_note": f"⚠ Fetch klines invalid (last_ts={last_candle_ts}, gap={int((sig_ts - last_candle_ts)/60)}p) — server có thể bị rate limit/Binance ban IP. Thử lại sau vài phút.",
                         "bt_candles": None, "bt_pnl_r": None, "bt_exit_price": None}
 
-        df_after = df[df["ts"] > sig_ts].reset_index(drop=True)
+        # Index đã sort theo open_time → binary search thay vì mask cả cột
+        df_after = df.iloc[int(np.searchsorted(ts, sig_ts, side="right")):]
 
         # Recompute sl_pct / tp1_pct từ entry đang dùng (có thể là entry_opt)
         if bt_used_entry == "OPT" and entry > 0:
@@ -1503,7 +1776,7 @@ def backtest_signal(signal: dict, bt_mode: str = "MARKET") -> dict:
         # giữa cột Entry trên dashboard và % PnL trong note.
         if len(df_after) == 0:
             last_price = float(df["close"].iloc[-1])
-            last_ts    = int(df["ts"].iloc[-1])
+            last_ts    = int(ts[-1])
             mins_gap   = max(0, int((sig_ts - last_ts) / 60))
 
             # Recompute sl_pct/tp1_pct từ entry_orig (không dùng entry_opt swap)
@@ -1535,76 +1808,60 @@ def backtest_signal(signal: dict, bt_mode: str = "MARKET") -> dict:
         entry_filled   = not is_limit  # market order → đã khớp ngay
         entry_fill_idx = None          # nến nào giá chạm entry
 
-        # Track actual extremes after entry — diagnostic để user verify SL/TP detect
-        actual_low_after  = float("inf")
-        actual_high_after = float("-inf")
-
-        for i, row in df_after.iterrows():
-            high = float(row["high"])
-            low  = float(row["low"])
-
-            # Nếu là Limit, chờ giá chạm entry trước
-            if not entry_filled:
-                # EXPIRED check: nếu vượt timeout chờ fill → cancel signal
-                elapsed_h = (i + 1) * minutes_per_candle / 60
-                if elapsed_h > FILL_TIMEOUT_HOURS:
-                    return {**signal,
-                            "bt_result":      "EXPIRED",
-                            "bt_note":        f"EXPIRED — không chạm {('entry_opt' if bt_used_entry=='OPT' else 'limit entry')} {entry} trong {FILL_TIMEOUT_HOURS}h ({i+1} nến {bt_label})",
-                            "bt_candles":     i + 1,
-                            "bt_pnl_r":       None,
-                            "bt_exit_price":  None,
-                            "bt_exit_reason": "EXPIRED",
-                            "bt_used_entry":  bt_used_entry,
-                            "bt_fill_candles": None}
-                if direction == "LONG"  and low  <= entry:
-                    entry_filled   = True
-                    entry_fill_idx = i
-                elif direction == "SHORT" and high >= entry:
-                    entry_filled   = True
-                    entry_fill_idx = i
-                else:
-                    continue  # chưa khớp → bỏ qua nến này
-
-            # Track giá max/min sau khi đã khớp entry
-            actual_low_after  = min(actual_low_after, low)
-            actual_high_after = max(actual_high_after, high)
+        # Duyệt mảng numpy song song — tránh iterrows tạo Series cho mỗi nến
+        highs = df_after["high"].to_numpy(dtype=np.float64)
+        lows  = df_after["low"].to_numpy(dtype=np.float64)
 
-            # ── Bước 2: Đã khớp entry → check TP/SL ──
-            if direction == "LONG":
-                hit_sl  = low  <= sl
-                hit_tp1 = high >= tp1
-            else:
-                hit_sl  = high >= sl
-                hit_tp1 = low  <= tp1
-
-            if hit_tp1 and hit_sl:
-                # Cùng nến — giả định TP trước (conservative)
-                result     = "WIN"
-                exit_price = tp1
-                pnl_r      = round(tp1_pct / sl_pct, 2) if sl_pct > 0 else 0
-            elif hit_tp1:
-                result     = "WIN"
-                exit_price = tp1
-                pnl_r      = round(tp1_pct / sl_pct, 2) if sl_pct > 0 else 0
-            elif hit_sl:
-                result     = "LOSS"
-                exit_price = sl
-                pnl_r      = -1.0
-            else:
-                continue
+        # Nếu là Limit, chờ giá chạm entry trước — nến khớp đầu tiên qua mask + argmax.
+        # EXPIRED: nến đầu tiên có (i+1)*phút/60 > FILL_TIMEOUT_HOURS; check trước fill
+        # trong cùng nến như logic cũ → fill ở nến ≥ i_expire tính là EXPIRED.
+        if not entry_filled:
+            fill_hits = (lows <= entry) if direction == "LONG" else (highs >= entry)
+            fill_idx  = int(fill_hits.argmax()) if fill_hits.any() else len(highs)
+            i_expire  = int(FILL_TIMEOUT_HOURS * 60 // minutes_per_candle)
+            if i_expire < len(highs) and i_expire <= fill_idx:
+                return {**signal,
+                        "bt_result":      "EXPIRED",
+                        "bt_note":        f"EXPIRED — không chạm {('entry_opt' if bt_used_entry=='OPT' else 'limit entry')} {entry} trong {FILL_TIMEOUT_HOURS}h ({i_expire+1} nến {bt_label})",
+                        "bt_candles":     i_expire + 1,
+                        "bt_pnl_r":       None,
+                        "bt_exit_price":  None,
+                        "bt_exit_reason": "EXPIRED",
+                        "bt_used_entry":  bt_used_entry,
+                        "bt_fill_candles": None}
+            if fill_idx < len(highs):
+                entry_filled   = True
+                entry_fill_idx = fill_idx
+
+        if entry_filled:
+            # ── Bước 2: Đã khớp entry → check TP/SL (kernel _first_hit) ──
+            start = entry_fill_idx or 0
+            kind, i = _first_hit(highs, lows, sl, tp1, direction == "LONG", start)
+            if kind != 2:
+                if kind == 0:
+                    result     = "WIN"
+                    exit_price = tp1
+                    pnl_r      = round(tp1_pct / sl_pct, 2) if sl_pct > 0 else 0
+                else:
+                    result     = "LOSS"
+                    exit_price = sl
+                    pnl_r      = -1.0
 
-            fill_note = f" (khớp nến {entry_fill_idx+1})" if entry_fill_idx is not None else ""
-            time_est = round((i+1) * minutes_per_candle / 60, 1)
-            return {**signal,
-                    "bt_result":       result,
-                    "bt_note":         f"Chạm {'TP1' if result=='WIN' else 'SL'} sau {i+1} nến {bt_label} (~{time_est}h){fill_note}",
-                    "bt_candles":      i + 1,
-                    "bt_pnl_r":        pnl_r,
-                    "bt_exit_price":   round(exit_price, 6),
-                    "bt_exit_reason":  "TP" if result == "WIN" else "SL",
-                    "bt_used_entry":   bt_used_entry,
-                    "bt_fill_candles": entry_fill_idx}
+                fill_note = f" (khớp nến {entry_fill_idx+1})" if entry_fill_idx is not None else ""
+                time_est = round((i+1) * minutes_per_candle / 60, 1)
+                return {**signal,
+                        "bt_result":       result,
+                        "bt_note":         f"Chạm {'TP1' if result=='WIN' else 'SL'} sau {i+1} nến {bt_label} (~{time_est}h){fill_note}",
+                        "bt_candles":      i + 1,
+                        "bt_pnl_r":        pnl_r,
+                        "bt_exit_price":   round(exit_price, 6),
+                        "bt_exit_reason":  "TP" if result == "WIN" else "SL",
+                        "bt_used_entry":   bt_used_entry,
+                        "bt_fill_candles": entry_fill_idx}
+
+            # Track giá max/min sau khi đã khớp entry — diagnostic để user verify SL/TP detect
+            actual_low_after  = float(lows[start:].min())
+            actual_high_after = float(highs[start:].max())
 
         # ── Bước 3: Hết dữ liệu ──
         # 3a: Limit chưa fill → nếu hours_since vượt timeout → EXPIRED, ngược lại PENDING
@@ -3653,13 +3910,16 @@ def _extract_bt_fields(result):
     return {k: result.get(k) for k in _BT_FIELDS if k in result}
 
 
-def backtest_signal_dual(signal):
+def backtest_signal_dual(signal, klines: dict = None):
     """Backtest 1 signal cho 3 modes: MARKET + LIMIT + LIMIT_SAFE_SL.
     Trả về single dict với fields 'market_bt', 'limit_bt', 'limit_safe_bt'.
+    Klines fetch 1 lần dùng chung cho cả 3 mode (trước: 3 lần fetch y hệt).
     """
-    market_result = backtest_signal(signal, "MARKET")
-    limit_result  = backtest_signal(signal, "LIMIT")
-    safe_result   = backtest_signal(signal, "LIMIT_SAFE_SL")
+    if klines is None:
+        klines = prefetch_bt_klines([signal], max_workers=1)
+    market_result = backtest_signal(signal, "MARKET", klines)
+    limit_result  = backtest_signal(signal, "LIMIT", klines)
+    safe_result   = backtest_signal(signal, "LIMIT_SAFE_SL", klines)
     return {
         **signal,
         "market_bt":     _extract_bt_fields(market_result),
@@ -3671,50 +3931,64 @@ def backtest_signal_dual(signal):
 def _compute_summary_for_mode(results, source_key=None):
     """Compute summary stats. source_key=None nghĩa là single mode (bt_* fields ở root).
     source_key='market_bt' nghĩa là dual mode, đọc từ result['market_bt']['bt_*']."""
-    def _get(r, field):
-        if source_key:
-            return (r.get(source_key) or {}).get(field)
-        return r.get(field)
-
-    wins     = [r for r in results if _get(r, "bt_result") == "WIN"]
-    losses   = [r for r in results if _get(r, "bt_result") == "LOSS"]
-    opens    = [r for r in results if _get(r, "bt_result") == "OPEN"]
-    pendings = [r for r in results if _get(r, "bt_result") == "PENDING"]
-    expired  = [r for r in results if _get(r, "bt_result") == "EXPIRED"]
-    errors   = [r for r in results if _get(r, "bt_result") == "ERROR"]
-    closed   = wins + losses
-    win_rate = round(len(wins) / len(closed) * 100, 1) if closed else 0
-    pnl_rs   = [_get(r, "bt_pnl_r") for r in closed if _get(r, "bt_pnl_r") is not None]
-    total_r  = round(sum(pnl_rs), 2)
-    avg_r    = round(sum(pnl_rs) / len(pnl_rs), 2) if pnl_rs else 0
-    avg_win_r  = round(sum(_get(r, "bt_pnl_r") for r in wins   if _get(r, "bt_pnl_r")) / len(wins),   2) if wins   else 0
-    avg_loss_r = round(sum(_get(r, "bt_pnl_r") for r in losses if _get(r, "bt_pnl_r")) / len(losses), 2) if losses else 0
-    expectancy = round((len(wins)/len(closed)) * avg_win_r + (len(losses)/len(closed)) * avg_loss_r, 2) if closed else 0
-    avg_candles_win  = round(sum(_get(r, "bt_candles") for r in wins   if _get(r, "bt_candles")) / len(wins),  1) if wins  else None
-    avg_candles_loss = round(sum(_get(r, "bt_candles") for r in losses if _get(r, "bt_candles")) / len(losses), 1) if losses else None
+    # 1 lượt duyệt duy nhất: đếm theo bt_result + gom pnl/candles vào list rồi sum 1 lần
+    # (thay ~10 list comprehension quét lại results). Giữ sum() tuần tự như cũ —
+    # np.sum cộng theo thứ tự khác, lệch 0.01 ở số đã round.
+    counts = {"WIN": 0, "LOSS": 0, "OPEN": 0, "PENDING": 0, "EXPIRED": 0, "ERROR": 0}
+    win_r, loss_r, win_c, loss_c = [], [], [], []
+    n_opt = n_opt_filled = 0
+    for r in results:
+        bt  = (r.get(source_key) or {}) if source_key else r
+        res = bt.get("bt_result")
+        if res in counts:
+            counts[res] += 1
+        if res == "WIN" or res == "LOSS":
+            pnl = bt.get("bt_pnl_r")
+            c   = bt.get("bt_candles")
+            if pnl is not None:
+                (win_r if res == "WIN" else loss_r).append(pnl)
+            if c:
+                (win_c if res == "WIN" else loss_c).append(c)
+        if source_key == "limit_bt" and bt.get("bt_used_entry") == "OPT":
+            n_opt += 1
+            if bt.get("bt_fill_candles") is not None:
+                n_opt_filled += 1
+
+    n_win, n_loss = counts["WIN"], counts["LOSS"]
+    n_closed = n_win + n_loss
+    pnl_rs   = win_r + loss_r
+    sum_r    = sum(pnl_rs)
+
+    win_rate = round(n_win / n_closed * 100, 1) if n_closed else 0
+    total_r  = round(sum_r, 2)
+    avg_r    = round(sum_r / len(pnl_rs), 2) if pnl_rs else 0
+    # Chia cho tổng số WIN/LOSS (kể cả record thiếu pnl) — giữ như công thức cũ
+    avg_win_r  = round(sum(win_r)  / n_win,  2) if n_win  else 0
+    avg_loss_r = round(sum(loss_r) / n_loss, 2) if n_loss else 0
+    expectancy = round((n_win/n_closed) * avg_win_r + (n_loss/n_closed) * avg_loss_r, 2) if n_closed else 0
+    avg_candles_win  = round(sum(win_c)  / n_win,  1) if n_win  else None
+    avg_candles_loss = round(sum(loss_c) / n_loss, 1) if n_loss else None
 
     # Fill rate cho LIMIT mode
     fill_stats = None
     if source_key == "limit_bt":
-        with_opt = [r for r in results if _get(r, "bt_used_entry") == "OPT"]
-        opt_filled = [r for r in with_opt if _get(r, "bt_fill_candles") is not None]
         fill_stats = {
-            "with_entry_opt":   len(with_opt),
-            "filled":           len(opt_filled),
-            "fill_rate_pct":    round(len(opt_filled)/len(with_opt)*100, 1) if with_opt else None,
-            "expired":          len(expired),
-            "pending":          len(pendings),
+            "with_entry_opt":   n_opt,
+            "filled":           n_opt_filled,
+            "fill_rate_pct":    round(n_opt_filled/n_opt*100, 1) if n_opt else None,
+            "expired":          counts["EXPIRED"],
+            "pending":          counts["PENDING"],
         }
 
     return {
         "total":           len(results),
-        "closed":          len(closed),
-        "wins":            len(wins),
-        "losses":          len(losses),
-        "opens":           len(opens),
-        "pending":         len(pendings),
-        "expired":         len(expired),
-        "errors":          len(errors),
+        "closed":          n_closed,
+        "wins":            n_win,
+        "losses":          n_loss,
+        "opens":           counts["OPEN"],
+        "pending":         counts["PENDING"],
+        "expired":         counts["EXPIRED"],
+        "errors":          counts["ERROR"],
         "win_rate":        win_rate,
         "total_r":         total_r,
         "avg_r":           avg_r,
@@ -3892,9 +4166,10 @@ def run_backtest():
     max_signals = min(max(max_signals_req, 1), 500)
     signals_to_run = signals[:max_signals]
     truncated = total_available > max_signals
-    bt_fn = backtest_signal_dual if bt_mode == "DUAL" else backtest_signal
-    bt_args = (bt_fn,) if bt_mode == "DUAL" else (lambda s: backtest_signal(s, bt_mode),)
-    submit_fn = backtest_signal_dual if bt_mode == "DUAL" else (lambda s: backtest_signal(s, bt_mode))
+    # Fetch klines 1 lần/coin trước (I/O), rồi backtest từng signal trên df dùng chung
+    klines = prefetch_bt_klines(signals_to_run)
+    submit_fn = (lambda s: backtest_signal_dual(s, klines)) if bt_mode == "DUAL" \
+                else (lambda s: backtest_signal(s, bt_mode, klines))
     with concurrent.futures.ThreadPoolExecutor(max_workers=8) as ex:
         futures = {ex.submit(submit_fn, sig): sig for sig in signals_to_run}
         for fut in concurrent.futures.as_completed(futures, timeout=300):
@@ -3970,11 +4245,12 @@ def run_backtest_signals():
         return jsonify({"results": [], "summary": {}, "error": "Không có signal"})
 
     results = []
+    klines = prefetch_bt_klines(signals)
     for sig in signals:
         if bt_mode == "DUAL":
-            r = backtest_signal_dual(sig)
+            r = backtest_signal_dual(sig, klines)
         else:
-            r = backtest_signal(sig, bt_mode)
+            r = backtest_signal(sig, bt_mode, klines)
         results.append(r)
 
     if bt_mode == "DUAL":
@@ -4036,8 +4312,9 @@ def auto_analyze_backtest():
     # Backtest
     signals_to_bt = sorted(signals, key=lambda h: h.get("time", "")[:19], reverse=True)[:50]
     results = []
+    klines = prefetch_bt_klines(signals_to_bt, max_workers=5)
     with concurrent.futures.ThreadPoolExecutor(max_workers=5) as ex:
-        futures = {ex.submit(backtest_signal, sig, bt_mode): sig for sig in signals_to_bt}
+        futures = {ex.submit(backtest_signal, sig, bt_mode, klines): sig for sig in signals_to_bt}
         for fut in concurrent.futures.as_completed(futures, timeout=110):
             try:
                 results.append(fut.result())
@@ -4125,20 +4402,28 @@ def auto_analyze_backtest():
         "score_analysis": score_insights,
     })
 
+def _start_scanner_threads():
+    """Bật 3 loop nền với 1 Event dừng mới. Trả False nếu đang chạy rồi."""
+    global scanner_running, _stop_evt
+    with _scanner_start_lock:   # auto-start thread và POST /start có thể chạy cùng lúc
+        if scanner_running:
+            return False
+        scanner_running = True
+        _stop_evt = stop = threading.Event()
+    for loop in (dashboard_scanner_loop, watchlist_fast_loop, position_monitor_loop):
+        threading.Thread(target=loop, args=(stop,), daemon=True).start()
+    return True
+
 @app.route("/api/scanner/start", methods=["POST"])
 def start_dashboard_scanner():
-    global scanner_running
-    if not scanner_running:
-        scanner_running = True
-        threading.Thread(target=dashboard_scanner_loop, daemon=True).start()
-        threading.Thread(target=watchlist_fast_loop, daemon=True).start()
-        threading.Thread(target=position_monitor_loop, daemon=True).start()
+    _start_scanner_threads()
     return jsonify({"running": True})
 
 @app.route("/api/scanner/stop", methods=["POST"])
 def stop_dashboard_scanner():
     global scanner_running
     scanner_running = False
+    _stop_evt.set()
     return jsonify({"running": False})
 
 @app.route("/api/scanner/status")
@@ -4178,7 +4463,9 @@ def market_scan_status():
         "found":      len(scan_state["results"]),
         "started_at": scan_state["started_at"],
         "finished_at":scan_state["finished_at"],
+        "duration_ms":scan_state.get("duration_ms"),
         "error":      scan_state["error"],
+        "errors":     len(scan_state.get("errors") or []),
     })
 
 @app.route("/api/market-scan/results")
@@ -4190,16 +4477,62 @@ def market_scan_results():
     return jsonify(results)
 
 # ── Telegram ─────────────────────────────────
+# Session keep-alive tới api.telegram.org — tránh TLS handshake mỗi alert.
+# Retry chỉ áp cho lỗi connect (urllib3 không retry POST khi đã gửi request)
+# → không bao giờ gửi trùng tin nhắn.
+_tg_session = requests.Session()
+_tg_session.mount("https://", HTTPAdapter(
+    pool_connections=4, pool_maxsize=8,
+    max_retries=Retry(total=2, backoff_factor=0.2)))
+
 def send_telegram(token, chat_id, msg):
     if not token or not chat_id: return False
     try:
-        r = requests.post(
+        r = _tg_session.post(
             f"https://api.telegram.org/bot{token}/sendMessage",
             json={"chat_id": chat_id, "text": msg},
             timeout=5)
         return r.status_code == 200
     except: return False
 
+# Hàng đợi alert — scan/monitor loop chỉ enqueue, worker riêng gửi Telegram.
+# Mạng chậm (timeout 5s) không còn chặn việc phân tích symbol tiếp theo.
+# Đầy hàng đợi → bỏ alert CŨ NHẤT (alert mới luôn có giá trị hơn).
+_tg_queue = queue.Queue(maxsize=128)
+_tg_worker_started = False
+_tg_worker_lock = threading.Lock()
+
+def _tg_worker():
+    while True:
+        token, chat_id, msg = _tg_queue.get()
+        try:
+            if not send_telegram(token, chat_id, msg):
+                print(f"[TELEGRAM ERROR] Gửi alert thất bại ({len(msg)} ký tự)")
+        finally:
+            _tg_queue.task_done()
+
+def queue_telegram(token, chat_id, msg):
+    """Gửi Telegram bất đồng bộ (fire-and-forget). Dùng cho alert trên đường scan."""
+    global _tg_worker_started
+    if not token or not chat_id: return
+    if not _tg_worker_started:
+        with _tg_worker_lock:
+            if not _tg_worker_started:
+                threading.Thread(target=_tg_worker, daemon=True).start()
+                _tg_worker_started = True
+    item = (token, chat_id, msg)
+    while True:
+        try:
+            _tg_queue.put_nowait(item)
+            return
+        except queue.Full:
+            try:
+                _tg_queue.get_nowait()
+                _tg_queue.task_done()
+                print("[TELEGRAM] Hàng đợi đầy — bỏ alert cũ nhất")
+            except queue.Empty:
+                pass
+
 def _parse_position_command(text: str) -> dict:
     """Parse các command position từ Telegram.
     Cú pháp:
@@ -4398,7 +4731,7 @@ def telegram_setup_webhook():
 
     webhook_url = f"{base_url.rstrip('/')}/api/telegram/webhook"
     try:
-        r = requests.post(
+        r = _tg_session.post(
             f"https://api.telegram.org/bot{token}/setWebhook",
             json={"url": webhook_url, "allowed_updates": ["message"]},
             timeout=10,
@@ -4427,17 +4760,12 @@ def auto_start_scanner():
     → không đào sâu ban Binance. Bật lại bằng config auto_start_scanner=true HOẶC
     gọi POST /api/scanner/start khi mọi thứ đã ổn.
     """
-    global scanner_running
     cfg = load_config()
     if not cfg.get("auto_start_scanner", False):
         print("[AUTO-START] tắt (auto_start_scanner=false) — chống 418 khi restart. "
               "Bật scanner qua POST /api/scanner/start.")
         return
-    if not scanner_running:
-        scanner_running = True
-        threading.Thread(target=dashboard_scanner_loop, daemon=True).start()
-        threading.Thread(target=watchlist_fast_loop, daemon=True).start()
-        threading.Thread(target=position_monitor_loop, daemon=True).start()
+    if _start_scanner_threads():
         print("[AUTO-START] Dashboard scanner started automatically")
 
 # Chạy auto-start trong thread riêng để không block gunicorn worker
@@ -4459,10 +4787,11 @@ except Exception as _e:
 def set_scan_modes():
     """Cập nhật scan_modes: ['TREND'], ['RANGE_SCALP'], ['TREND','RANGE_SCALP']."""
     data = request.get_json() or {}
-    cfg  = load_config()
     modes = data.get("modes", ["TREND"])
-    cfg["scan_modes"] = [m for m in modes if m in ("TREND", "RANGE_SCALP")]
-    save_config(cfg)
+    with _config_lock:
+        cfg = load_config()
+        cfg["scan_modes"] = [m for m in modes if m in ("TREND", "RANGE_SCALP")]
+        save_config(cfg)
     return jsonify({"ok": True, "scan_modes": cfg["scan_modes"]})
 
 
@@ -4473,9 +4802,10 @@ def toggle_auto_funding_watchlist():
     """
     data = request.get_json() or {}
     enabled = bool(data.get("enabled", False))
-    cfg = load_config()
-    cfg["auto_funding_watchlist"] = enabled
-    save_config(cfg)
+    with _config_lock:
+        cfg = load_config()
+        cfg["auto_funding_watchlist"] = enabled
+        save_config(cfg)
     return jsonify({"ok": True, "auto_funding_watchlist": enabled})
 
 
@@ -4506,11 +4836,12 @@ def set_watchlist_algo():
     algo = data.get("algo", "TREND")
     if not sym:
         return jsonify({"ok": False, "error": "Missing symbol"}), 400
-    cfg  = load_config()
-    if "watchlist_algos" not in cfg:
-        cfg["watchlist_algos"] = {}
-    cfg["watchlist_algos"][sym] = algo
-    save_config(cfg)
+    with _config_lock:
+        cfg  = load_config()
+        if "watchlist_algos" not in cfg:
+            cfg["watchlist_algos"] = {}
+        cfg["watchlist_algos"][sym] = algo
+        save_config(cfg)
     return jsonify({"ok": True, "symbol": sym, "algo": algo})
 
 
@@ -4521,17 +4852,18 @@ def set_range_override():
     sym  = data.get("symbol", "").upper()
     if not sym:
         return jsonify({"ok": False, "error": "Missing symbol"}), 400
-    cfg  = load_config()
-    if "range_override" not in cfg:
-        cfg["range_override"] = {}
-    if data.get("clear"):
-        cfg["range_override"].pop(sym, None)
-    else:
-        cfg["range_override"][sym] = {
-            "range_high": float(data.get("range_high", 0)),
-            "range_low":  float(data.get("range_low",  0)),
-        }
-    save_config(cfg)
+    with _config_lock:
+        cfg  = load_config()
+        if "range_override" not in cfg:
+            cfg["range_override"] = {}
+        if data.get("clear"):
+            cfg["range_override"].pop(sym, None)
+        else:
+            cfg["range_override"][sym] = {
+                "range_high": float(data.get("range_high", 0)),
+                "range_low":  float(data.get("range_low",  0)),
+            }
+        save_config(cfg)
     return jsonify({"ok": True, "symbol": sym, "range_override": cfg["range_override"].get(sym)})
 
 
@@ -4561,4 +4893,14 @@ if __name__ == "__main__":
     print(f"\n🚀 CryptoDesk running at http://127.0.0.1:{port}\n")
     print("   Tab 1: Dashboard — theo dõi mã cụ thể")
     print("   Tab 2: Market Scan — quét toàn thị trường\n")
-    app.run(debug=False, host="0.0.0.0", port=port)
+    if os.environ.get("FLASK_DEBUG") == "1":
+        # Dev: debugger bật nhưng KHÔNG reloader — reloader spawn 2 process → 2 bộ
+        # scanner thread chạy song song, gấp đôi call Binance.
+        app.run(debug=True, use_reloader=False, host="0.0.0.0", port=port)
+    else:
+        try:
+            from waitress import serve
+            serve(app, host="0.0.0.0", port=port, threads=8, connection_limit=200)
+        except ImportError:
+            # Không có waitress → dev server Werkzeug, nhưng vẫn đa luồng
+            app.run(debug=False, host="0.0.0.0", port=port, threaded=True)
@@ -47,12 +47,15 @@ def _save(p):
     try: json.dump(p, open(PAPER_FILE, "w"), indent=2, default=str)
     except Exception as e: print(f"[paper save err] {e}")
 
+# Keep-alive tới api.telegram.org — gửi nhiều alert liên tiếp không handshake lại từng tin
+_tg_session = requests.Session()
+
 def _tg(msg):
     try:
         cfg = json.load(open(CONFIG))
         token, chat = cfg.get("telegram_token"), cfg.get("telegram_chat")
         if token and chat:
-            requests.post(f"https://api.telegram.org/bot{token}/sendMessage",
+            _tg_session.post(f"https://api.telegram.org/bot{token}/sendMessage",
                           json={"chat_id": chat, "text": msg}, timeout=5)
     except Exception as e: print(f"[paper tg err] {e}")
 
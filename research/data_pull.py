@@ -16,6 +16,7 @@ Chạy: python3 research/data_pull.py
 """
 import sys, os, json, time
 import requests
+from requests.adapters import HTTPAdapter
 import pandas as pd
 
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -45,10 +46,16 @@ STABLE_PAT   = re.compile(r'^(USDC|BUSD|TUSD|FDUSD|USDP|DAI|FRAX|LUSD|SUSD|USDD|
 HARD_BL      = {"LUNA2USDT", "LUNCUSDT", "LUNAUSDT", "USDTUSDT", "BCCUSDT"}
 
 
+# Session keep-alive dùng chung — kéo phân trang hàng nghìn request tới fapi.binance.com,
+# không handshake TLS lại mỗi trang. Retry/backoff 429 do _get tự lo → adapter không retry.
+_session = requests.Session()
+_session.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=8))
+
+
 def _get(url, params, retries=4):
     for attempt in range(retries):
         try:
-            r = requests.get(url, params=params, timeout=15)
+            r = _session.get(url, params=params, timeout=15)
             if r.status_code == 429:
                 time.sleep(2 ** attempt)
                 continue
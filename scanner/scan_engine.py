@@ -1,15 +1,21 @@
 """scanner/scan_engine.py — Full Market Scanner.
 Dùng chung engine với Dashboard — theo strategy được chọn (SWING_H4 hoặc SWING_H1).
 """
-import json
+import heapq
+import math
 import threading
-from concurrent.futures import ThreadPoolExecutor, as_completed
+import time
+import traceback
+from types import MappingProxyType
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from itertools import islice
+from operator import itemgetter
 from datetime import datetime, timezone, timedelta
 _TZ_VN = timezone(timedelta(hours=7))
 from pathlib import Path
 
-from core.binance import fetch_all_futures_tickers
-from core.utils import sanitize
+from core.binance import fetch_all_futures_tickers, scan_rate_limiter
+from core.utils import AnalyzeCache, sanitize, json_dumps, json_loads
 
 # CAP số coin quét full-market (chống tải Binance/418). Top-N theo volume.
 MAX_SCAN_COINS = 30
@@ -17,7 +23,9 @@ MAX_SCAN_COINS = 30
 # Dùng cùng volume path với main.py
 import os as _os
 _SCAN_DATA_DIR  = Path("/data") if Path("/data").exists() and _os.access("/data", _os.W_OK) else Path("data")
-SCAN_CACHE_FILE = _SCAN_DATA_DIR / "last_scan.json"
+SCAN_CACHE_FILE   = _SCAN_DATA_DIR / "last_scan.json"         # format cũ (1 file JSON) — chỉ đọc để migrate
+SCAN_RESULTS_FILE = _SCAN_DATA_DIR / "last_scan.jsonl"       # 1 dòng/kết quả, append trong lúc scan
+SCAN_META_FILE    = _SCAN_DATA_DIR / "last_scan.meta.json"   # finished_at/total/strategy, ghi atomic
 
 def _clean_for_json(obj):
     """Replace NaN/Infinity → None, numpy types → native Python."""
@@ -32,26 +40,71 @@ def _clean_for_json(obj):
         return [_clean_for_json(v) for v in obj]
     return obj
 
-def _persist_scan_state(state: dict):
-    """Lưu kết quả scan vào file để survive restart."""
+_CONF_ORDER = {"HIGH": 0, "MEDIUM": 1, "LOW": 2}
+
+def _result_sort_key(x: dict):
+    """Thứ tự hiển thị: HIGH → MEDIUM → LOW, trong mỗi tier sort score rồi R:R.
+    `or 0`: kết quả đọc lại từ file có thể mang None (NaN đã bị _clean_for_json đổi).
+    list.sort(key=) đã tính key đúng 1 lần/phần tử; ≤ MAX_SCAN_COINS kết quả nên dựng
+    mảng numpy + lexsort còn tốn hơn chính lần sort này. Không precompute _conf_rank/_nscore
+    vào result để dùng itemgetter: key chỉ tính 1 lần lúc push heap, còn field phụ sẽ lọt
+    ra JSONL/API."""
+    return (_CONF_ORDER.get(x.get("confidence", "LOW"), 3), -(x.get("score") or 0), -(x.get("rr") or 0))
+
+
+def _persist_scan_meta(state: dict):
+    """Ghi sidecar meta (finished_at/total/strategy) — tmp + os.replace nên không bao giờ dở dang."""
     try:
-        SCAN_CACHE_FILE.parent.mkdir(exist_ok=True)
+        SCAN_META_FILE.parent.mkdir(exist_ok=True)
         data = _clean_for_json({
-            "results":     state.get("results", []),
             "finished_at": state.get("finished_at"),
             "total":       state.get("total", 0),
             "strategy":    state.get("strategy", "SWING_H4"),
         })
-        SCAN_CACHE_FILE.write_text(json.dumps(data, ensure_ascii=False, allow_nan=False, default=str))
+        tmp = SCAN_META_FILE.with_suffix(".tmp")
+        tmp.write_bytes(json_dumps(data, default=str).encode("utf-8"))
+        _os.replace(tmp, SCAN_META_FILE)
+    except Exception as e:
+        print(f"[SCAN PERSIST ERROR] {e}")
+
+def _open_scan_results_file():
+    """Truncate file kết quả khi bắt đầu scan mới; trả file handle append (None nếu lỗi)."""
+    try:
+        SCAN_RESULTS_FILE.parent.mkdir(exist_ok=True)
+        return SCAN_RESULTS_FILE.open("w", encoding="utf-8")
+    except Exception as e:
+        print(f"[SCAN PERSIST ERROR] {e}")
+        return None
+
+def _append_scan_result(fh, result: dict):
+    """Append 1 kết quả (1 dòng JSON) ngay khi symbol xong — crash giữa scan vẫn giữ phần đã quét."""
+    if fh is None:
+        return
+    try:
+        fh.write(json_dumps(_clean_for_json(result), default=str) + "\n")
+        fh.flush()
     except Exception as e:
         print(f"[SCAN PERSIST ERROR] {e}")
 
 def _load_persisted_scan() -> dict:
-    """Load kết quả scan từ file nếu có."""
+    """Load kết quả scan từ JSONL + meta; chưa có thì đọc file JSON cũ (migrate)."""
     try:
-        if SCAN_CACHE_FILE.exists():
-            data = json.loads(SCAN_CACHE_FILE.read_text())
+        if SCAN_RESULTS_FILE.exists():
+            data = {}
+            if SCAN_META_FILE.exists():
+                data = json_loads(SCAN_META_FILE.read_bytes())
+            results = []
+            with SCAN_RESULTS_FILE.open("rb") as f:
+                for line in f:
+                    try:
+                        results.append(json_loads(line))
+                    except ValueError:
+                        pass  # dòng cuối ghi dở khi crash
+            results.sort(key=_result_sort_key)
+            data["results"] = results
             return data
+        if SCAN_CACHE_FILE.exists():
+            return json_loads(SCAN_CACHE_FILE.read_bytes())
     except Exception:
         pass
     return {}
@@ -62,15 +115,18 @@ from dashboard.range_engine     import range_analyze
 from dashboard.reversal_engine  import reversal_analyze
 
 _persisted = _load_persisted_scan()
+_persisted_results = tuple(_persisted.get("results") or ())
 scan_state = {
     "running":     False,
     "progress":    0,
     "total":       _persisted.get("total", 0),
-    "results":     _persisted.get("results", []),
-    "last_results": _persisted.get("results", []),  # backup — luôn giữ kết quả scan cuối
+    "results":     _persisted_results,
+    "last_results": _persisted_results,  # backup — luôn giữ kết quả scan cuối
     "started_at":  None,
     "finished_at": _persisted.get("finished_at"),
+    "duration_ms": None,  # thời lượng lượt scan gần nhất (monotonic — không lệch khi chỉnh giờ máy)
     "error":       None,
+    "errors":      [],   # [(symbol, repr(exception))] của lượt scan gần nhất
     "strategy":    _persisted.get("strategy", "SWING_H4"),
 }
 _state_lock = threading.Lock()
@@ -108,6 +164,30 @@ def _get_engines_for_modes(cfg):
     return engines
 
 
+# Weight ước lượng 1 symbol/engine: ~6 call Binance (klines D1/H4/H1, ticker, funding, OI)
+_SYM_WEIGHT = 6
+
+# Cache kết quả engine riêng của scanner (cfg khác dashboard) — scan chạy lại trong
+# cùng phút (bấm Scan 2 lần, scheduler trùng tay) không tính lại symbol đã có.
+# Giữ TTL ngắn như dashboard: giá/entry lấy từ nến H1 đang chạy, cache lâu sẽ cũ.
+_scan_analyze_cache = AnalyzeCache(ttl=55)
+
+# Progress scan: gom cập nhật, publish tối đa 1 lần/_PROGRESS_EVERY_S (và luôn ở symbol cuối)
+_PROGRESS_EVERY_S = 0.5
+
+# Worker động: bắt đầu với max_workers của caller, có đủ _WARMUP_SYMS mẫu latency thì
+# nới cửa sổ cho phần còn lại để xong trong ~_TARGET_SCAN_S (cùng 1 pool, không dừng chờ).
+# _throttle chỉ giãn thời điểm BẮT ĐẦU call — RTT cao thì 3 worker không đủ lấp nhịp
+# _MIN_GAP, RTT thấp thì worker thừa chỉ đứng chờ lock. Trần thấp vì throttle +
+# scan_rate_limiter đã chặn tổng call/giây, thêm thread quá mức không nhanh hơn.
+_WARMUP_SYMS    = 6
+_TARGET_SCAN_S  = 45.0
+_MAX_SCAN_WORKERS = 8
+
+# Mode có engine tự sanitize output (fam/swing_h1/scalp/reversal)
+_SANITIZED_MODES = frozenset({"TREND", "REVERSAL"})
+
+
 def _process_result(result, sym_info, mode_tag):
     """Xử lý kết quả từ engine: filter, tag, flatten — giữ đầy đủ các filter coin rác."""
     if result.get("direction") not in ("LONG", "SHORT"):
@@ -119,8 +199,8 @@ def _process_result(result, sym_info, mode_tag):
     # Backtest 6/8-6/14: GUA fire 5 SHORT all LOSS, SKR 3/3, BANANAS31 2/2, RKLB 2/2 → strict.
     sym = result.get("symbol", "")
     direction = result.get("direction", "")
-    blacklist = SCAN_CFG.get("coin_blacklist") or []
-    blacklist_strict = SCAN_CFG.get("coin_blacklist_strict") or []
+    blacklist = SCAN_CFG.get("coin_blacklist") or ()
+    blacklist_strict = SCAN_CFG.get("coin_blacklist_strict") or ()
     if sym in blacklist_strict:
         print(f"[STRICT BLACKLIST] {sym} {direction} blocked (toxic both directions)")
         return None
@@ -283,19 +363,24 @@ def _process_result(result, sym_info, mode_tag):
 
     # ── Tag algo source ──
     result["algo"] = mode_tag
-
-    # ── Flatten market data ──
-    result["volume_24h"]  = sym_info["volume_24h"]
-    mk = result.get("market", {})
-    result["funding"]     = mk.get("funding")
-    result["funding_str"] = mk.get("funding_pct") or "N/A"
-    result["oi_change"]   = mk.get("oi_change")
-    result["oi_str"]      = mk.get("oi_str") or "N/A"
-    result["atr_ratio"]   = mk.get("atr_ratio")
-
-    # ── D1/H4 bias cho history ──
-    result["d1_bias"] = (result.get("d1") or {}).get("bias", "")
-    result["h4_bias"] = (result.get("h4") or {}).get("bias", "")
+    # 80 nến chart là phần nặng nhất của result nhưng bảng scanner không vẽ chart
+    # (chart chỉ ở trang chi tiết symbol, gọi engine riêng) → bỏ khỏi payload/JSONL.
+    result.pop("candles", None)
+
+    # ── Flatten market data + D1/H4 bias cho history ──
+    # Result vẫn là dict: UI/history/persist đọc thẳng JSON với field riêng từng engine,
+    # dataclass cố định field sẽ phải asdict() lại ở mọi chỗ → chỉ gom về 1 lần update().
+    mk = result.get("market") or {}
+    result.update(
+        volume_24h  = sym_info["volume_24h"],
+        funding     = mk.get("funding"),
+        funding_str = mk.get("funding_pct") or "N/A",
+        oi_change   = mk.get("oi_change"),
+        oi_str      = mk.get("oi_str") or "N/A",
+        atr_ratio   = mk.get("atr_ratio"),
+        d1_bias     = (result.get("d1") or {}).get("bias", ""),
+        h4_bias     = (result.get("h4") or {}).get("bias", ""),
+    )
 
     # ══════════════════════════════════════════
     # TIER_RATING — compute tier per signal (22/5/2026)
@@ -304,9 +389,23 @@ def _process_result(result, sym_info, mode_tag):
     # ══════════════════════════════════════════
     result["tier"], result["tier_reasons"] = _compute_tier(result, sym_info)
 
+    # Engine TREND/REVERSAL đã `return sanitize(...)` và các field thêm ở trên đều là
+    # str/float native → không đệ quy lại lần 2. range_analyze chưa sanitize → giữ.
+    if mode_tag in _SANITIZED_MODES:
+        return result
     return sanitize(result)
 
 
+def _adaptive_workers(latencies: list, remaining: int, floor: int) -> int:
+    """Số worker cho phần còn lại của scan từ latency/symbol đo ở lượt warmup.
+    Không có mẫu (warmup lỗi hết / cache hit) → giữ floor (max_workers của caller)."""
+    if not latencies or remaining <= 0:
+        return floor
+    mean = sum(latencies) / len(latencies)
+    ideal = math.ceil(remaining * mean / _TARGET_SCAN_S)
+    return max(floor, min(_MAX_SCAN_WORKERS, ideal))
+
+
 def _compute_tier(result: dict, sym_info: dict) -> tuple:
     """Tính tier rating cho signal dựa trên 6 criteria từ backtest analysis.
     Returns: (tier_str, list_of_reasons)
@@ -418,37 +517,58 @@ def _compute_tier(result: dict, sym_info: dict) -> tuple:
     return tier, reasons
 
 
-def analyze_symbol(sym_info: dict):
-    import time as _t
+def _prefilter_engines(sym_info: dict, engines: list, cfg) -> list:
+    """Bỏ engine mà _process_result chắc chắn loại chỉ từ dữ liệu ticker/config — không
+    tốn fetch klines + tính indicator cho kết quả sẽ vứt. Chỉ lặp lại filter đã có:
+    - Strict blacklist (Filter 0): block cả 2 chiều → không chạy engine nào.
+    - Pump > 25% / dump < -20% 24h (Filter 4): chặn mọi mode trừ RANGE_SCALP."""
+    if sym_info["symbol"] in (cfg.get("coin_blacklist_strict") or ()):
+        return []
+    chg_24h = float(sym_info.get("price_change_pct", 0) or 0)
+    if chg_24h > 25 or chg_24h < -20:
+        return [e for e in engines if e[0] == "RANGE_SCALP"]
+    return engines
+
+
+def analyze_symbol(sym_info: dict, engines: list = None, cfg: dict = None, errors: list = None):
+    """Chạy các engine cho 1 symbol. run_full_scan truyền sẵn `engines`/`cfg` đã resolve
+    1 lần cho cả lượt scan; gọi lẻ không truyền thì tự resolve từ SCAN_CFG.
+    Lỗi engine/symbol vẫn nuốt (1 coin lỗi không làm hỏng scan) nhưng ghi
+    (symbol, repr) vào `errors` nếu caller truyền list."""
     symbol = sym_info["symbol"]
     try:
-        _t.sleep(0.3)
-        cfg     = {**SCAN_CFG, "force_futures": True}
-        engines = _get_engines_for_modes(cfg)
+        if cfg is None:
+            cfg = {**SCAN_CFG, "force_futures": True}
+        if engines is None:
+            engines = _get_engines_for_modes(cfg)
+        engines = _prefilter_engines(sym_info, engines, cfg)
+        if not engines:
+            return None
+        scan_rate_limiter.acquire(_SYM_WEIGHT * len(engines))
         results = []
 
         for mode_tag, engine_fn in engines:
             try:
-                result = engine_fn(symbol, cfg)
+                result = _scan_analyze_cache(engine_fn, symbol, cfg)
                 processed = _process_result(result, sym_info, mode_tag)
                 if processed:
                     results.append(processed)
             except Exception as e:
                 print(f"[SCAN {mode_tag}] {symbol}: {e}")
+                if errors is not None:
+                    errors.append((symbol, f"{mode_tag}: {e!r}"))
 
-        # Trả về result tốt nhất (ưu tiên HIGH confidence, rồi RR cao)
+        # Trả về result tốt nhất. Qua _process_result thì confidence luôn là HIGH và rr
+        # là số ≥ scan_min_rr → chỉ còn so RR, index thẳng không cần .get/default.
+        # max() lấy phần tử đầu khi hoà — giống sort ổn định + [0] trước đây.
         if not results:
             return None
-        results.sort(key=lambda r: (
-            0 if r.get("confidence") == "HIGH" else 1,
-            -(r.get("rr") or 0)
-        ))
-        return results[0]
+        return max(results, key=itemgetter("rr"))
 
     except Exception as e:
-        if "429" in str(e):
-            import time as _t2; _t2.sleep(2)
         print(f"[SCAN ERROR] {symbol}: {e}")
+        if errors is not None:
+            errors.append((symbol, repr(e)))
         return None
 
 
@@ -465,8 +585,9 @@ def run_full_scan(min_vol: float = 10_000_000, max_workers: int = 3, strategy: s
         try:
             from main import load_config
             _cfg = load_config()
-            SCAN_CFG["coin_blacklist"]        = _cfg.get("coin_blacklist") or []
-            SCAN_CFG["coin_blacklist_strict"] = _cfg.get("coin_blacklist_strict") or []
+            # frozenset 1 lần/scan → _process_result check `sym in` O(1) thay vì dò list mỗi symbol
+            SCAN_CFG["coin_blacklist"]        = frozenset(_cfg.get("coin_blacklist") or ())
+            SCAN_CFG["coin_blacklist_strict"] = frozenset(_cfg.get("coin_blacklist_strict") or ())
             SCAN_CFG["scan_min_rr"]           = float(_cfg.get("scan_min_rr", 1.8))
             print(f"[SCAN] Blacklist: {len(SCAN_CFG['coin_blacklist'])} LONG-only + {len(SCAN_CFG['coin_blacklist_strict'])} strict")
         except Exception as e:
@@ -491,9 +612,32 @@ def run_full_scan(min_vol: float = 10_000_000, max_workers: int = 3, strategy: s
             SCAN_CFG["btc_24h_chg"] = 0
             SCAN_CFG["btc_48h_chg"] = 0
             SCAN_CFG["btc_prev_24h_chg"] = 0
-        scan_state.update({"running": True, "progress": 0, "results": [],
-                           "error": None, "started_at": datetime.now(_TZ_VN).isoformat(),
-                           "finished_at": None, "strategy": strategy})
+        # BTC context chung cho mọi symbol — fetch 1 lần/scan, engine đọc cfg["_btc_ctx"]
+        # thay vì tự fetch lại cho từng coin. Fetch lỗi → bỏ key, engine tự fetch như cũ.
+        try:
+            from core.binance import fetch_btc_context
+            _btc_ctx = fetch_btc_context()
+        except Exception as e:
+            _btc_ctx = None
+            print(f"[SCAN] BTC context warning: {e}")
+        if _btc_ctx and _btc_ctx.get("price") is not None:
+            SCAN_CFG["_btc_ctx"] = _btc_ctx
+        else:
+            SCAN_CFG.pop("_btc_ctx", None)
+        # Funding mọi cặp trong 1 call /premiumIndex thay vì 1 call/symbol. Lỗi/rỗng → bỏ key,
+        # engine tự fetch từng symbol như cũ. OI không có endpoint batch → vẫn per-symbol.
+        from core.binance import fetch_all_funding_rates
+        _funding_map = fetch_all_funding_rates()
+        if _funding_map:
+            SCAN_CFG["_funding_map"] = _funding_map
+        else:
+            SCAN_CFG.pop("_funding_map", None)
+        # 1 timestamp cho cả lượt scan — engine dùng cfg["_scan_ts"] thay vì now() từng symbol
+        SCAN_CFG["_scan_ts"] = datetime.now(_TZ_VN).isoformat()
+        t_start_ns = time.monotonic_ns()
+        scan_state.update({"running": True, "progress": 0, "results": (),
+                           "error": None, "errors": [], "started_at": SCAN_CFG["_scan_ts"],
+                           "finished_at": None, "duration_ms": None, "strategy": strategy})
         # Giữ last_results không reset — frontend show kết quả cũ trong khi scan mới
     try:
         print(f"[SCAN] Bắt đầu fetch tickers min_vol={min_vol:,.0f}...")
@@ -504,36 +648,86 @@ def run_full_scan(min_vol: float = 10_000_000, max_workers: int = 3, strategy: s
         symbols = symbols[:MAX_SCAN_COINS]
         print(f"[SCAN] Lấy được {_total_avail} symbols → cap top {len(symbols)} theo volume")
         scan_state["total"] = len(symbols)
-        results, done = [], 0
-
-        with ThreadPoolExecutor(max_workers=max_workers) as ex:
-            futures = {ex.submit(analyze_symbol, s): s for s in symbols}
-            for fut in as_completed(futures):
-                done += 1
-                scan_state["progress"] = done
-                try:
-                    r = fut.result()
-                    if r: results.append(r)
-                except Exception as fe:
-                    print(f"[SCAN SYM ERROR] {fe}")
-                # Throttle nhẹ tránh 429
-                if done % 10 == 0:
-                    import time as _t; _t.sleep(0.5)
-
-        # Sort: HIGH → MEDIUM → LOW, trong mỗi tier sort score rồi R:R
-        conf_order = {"HIGH": 0, "MEDIUM": 1, "LOW": 2}
-        results.sort(key=lambda x: (
-            conf_order.get(x.get("confidence", "LOW"), 3),
-            -x.get("score", 0),
-            -x.get("rr", 0)
-        ))
-        scan_state["results"]      = results
-        scan_state["last_results"] = results  # backup cho lần restart tiếp
-        scan_state["finished_at"]  = datetime.now(_TZ_VN).isoformat()
-        _persist_scan_state(scan_state)
-        print(f"[SCAN] Lưu {len(results)} kết quả vào {SCAN_CACHE_FILE}")
+        # errors: worker analyze_symbol tự append (list.append thread-safe), thread gom chỉ đọc cuối scan
+        # Heap (key, thứ tự về, result): key tính 1 lần lúc push; thứ tự về làm tie-break
+        # → pop ra đúng như sort ổn định theo _result_sort_key, không cần sort cả list cuối scan
+        results_heap, done, errors = [], 0, []
+        _persist_scan_meta(scan_state)   # finished_at=None → scan đang dở
+        results_fh = _open_scan_results_file()
+
+        # Nhịp gọi Binance đã do core.binance._throttle quyết định (giãn các call cách nhau
+        # _MIN_GAP) → trần throughput = 1/_MIN_GAP call/s; số worker chỉ cần đủ lấp nhịp đó
+        # theo RTT thực tế → _adaptive_workers khi đủ mẫu warmup. Sleep ở vòng gom kết quả không
+        # giãn được worker nào (chỉ làm trễ progress) → đã bỏ.
+        # Không dùng ProcessPool: _throttle/ban guard/cache BTC context đều là state
+        # module-level trong 1 process — tách process sẽ nhân đôi nhịp gọi Binance.
+        # Scan chủ yếu chờ I/O mạng (requests nhả GIL khi chờ socket) nên thread là đủ.
+        # Chỉ khi có cài numba (tuỳ chọn, không nằm trong requirements.txt) thì kernel
+        # swing mới chạy nogil và phần tính toán mới song song thật giữa các thread.
+        # Chỉ thread gom kết quả ghi file → không cần lock cho results_fh
+        # cfg + danh sách engine cố định suốt lượt scan → resolve 1 lần, dùng chung mọi symbol.
+        # MappingProxyType: read-only — các thread engine dùng chung mà không ai ghi nhầm được
+        sym_cfg     = MappingProxyType({**SCAN_CFG, "force_futures": True})
+        sym_engines = _get_engines_for_modes(sym_cfg)
+        total, last_pub = len(symbols), 0.0
+        sym_latency = []   # list.append thread-safe — worker tự ghi latency của mình
+
+        def _timed_analyze(s):
+            t0 = time.monotonic()
+            try:
+                return analyze_symbol(s, sym_engines, sym_cfg, errors)
+            finally:
+                sym_latency.append(time.monotonic() - t0)
+
+        try:
+            # 1 pool đủ thread cho trần; số symbol chạy đồng thời = cửa sổ `workers` (future
+            # đang chờ). Xong 1 future mới nạp symbol kế → không dựng sẵn Future cho cả list,
+            # progress sát thực tế. Đủ mẫu warmup thì nới cửa sổ ngay, không barrier giữa scan.
+            workers, resized = max_workers, False
+            with ThreadPoolExecutor(max_workers=max(max_workers, _MAX_SCAN_WORKERS)) as ex:
+                todo, pending = iter(symbols), {}
+                while True:
+                    if not resized and len(sym_latency) >= _WARMUP_SYMS:
+                        workers = _adaptive_workers(sym_latency, total - done, max_workers)
+                        resized = True
+                        print(f"[SCAN] Latency warmup {sum(sym_latency)/len(sym_latency):.2f}s/symbol → {workers} worker")
+                    for s in islice(todo, workers - len(pending)):
+                        pending[ex.submit(_timed_analyze, s)] = s
+                    if not pending:
+                        break
+                    finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for fut in finished:
+                        sym_info = pending.pop(fut)
+                        done += 1   # biến local của thread gom — chỉ publish ra scan_state theo nhịp
+                        now = time.monotonic()
+                        if done == total or now - last_pub >= _PROGRESS_EVERY_S:
+                            with _state_lock:
+                                scan_state["progress"] = done
+                            last_pub = now
+                        try:
+                            r = fut.result()
+                            if r:
+                                heapq.heappush(results_heap, (_result_sort_key(r), done, r))
+                                _append_scan_result(results_fh, r)
+                        except Exception as fe:
+                            errors.append((sym_info["symbol"], repr(fe)))
+                            print(f"[SCAN SYM ERROR] {fe}")
+        finally:
+            if results_fh is not None:
+                results_fh.close()
+
+        # Publish 1 snapshot tuple bất biến dưới lock: reader chỉ cần `snap = scan_state["results"]`
+        # rồi duyệt thoải mái, không bao giờ thấy list đang dở hay bị sửa sau lưng.
+        results = tuple(heapq.heappop(results_heap)[2] for _ in range(len(results_heap)))
+        with _state_lock:
+            scan_state["errors"]       = errors
+            scan_state["results"]      = results
+            scan_state["last_results"] = results  # backup cho lần restart tiếp
+            scan_state["finished_at"]  = datetime.now(_TZ_VN).isoformat()
+            scan_state["duration_ms"]  = (time.monotonic_ns() - t_start_ns) // 1_000_000
+        _persist_scan_meta(scan_state)
+        print(f"[SCAN] Lưu {len(results)} kết quả vào {SCAN_RESULTS_FILE}")
     except Exception as e:
-        import traceback
         scan_state["error"] = str(e)
         print(f"[SCAN FATAL] {e}")
         traceback.print_exc()